@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pd_engine import PDEngine
+
+SIZES = (100, 500, 1000, 2000, 4000)
+# Update rules, plus imitate_best with incremental=True
+MODES = ('imitate_best', 'tft', 'incremental')
+BOUNDARIES = ('periodic', 'fixed')
+NEIGHBORHOODS = ('Moore', 'vonNeumann', 'hexagonal')
+# Cooperator density of the random grids in the cluster benchmarks: many
+# small clusters below the percolation threshold, one spanning cluster above
+CLUSTER_REGIMES = {'sparse': 0.2, 'dense': 0.7}
+TOURNAMENT_ROUNDS = (10, 100, 1000)
+TOURNAMENT_PLAYERS = (4, 8, 12)
+
+
+def measure(fn, min_time=1.0, max_calls=1000):
+    # Calls fn until min_time has passed (at least once) and returns the
+    # fastest and the median call in seconds
+    times = []
+    start = time.perf_counter()
+    while not times or (time.perf_counter() - start < min_time and len(times) < max_calls):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return min(times), float(np.median(times)), len(times)
+
+
+def _timed(case, fn, min_time, cells=None, items=None, unit=None):
+    # One result row; per-second rates use the median call
+    best, median, calls = measure(fn, min_time)
+    row = dict(case, best_s=best, median_s=median, calls=calls)
+    if unit is not None:
+        row[f'{unit}_per_s'] = (items or 1) / median
+    if cells is not None:
+        row['cells_per_s'] = cells * (items or 1) / median
+    return row
+
+
+def bench_update_grid(mode, n, min_time):
+    params = {'incremental': True} if mode == 'incremental' else {'strategy_mode': mode}
+    engine = PDEngine(n=n, seed=0, **params)
+    # The first generations of a random lattice are not representative
+    engine.run(5)
+    return _timed({'bench': 'update_grid', 'mode': mode, 'n': n}, engine.step, min_time,
+                  cells=n * n, unit='generations')
+
+
+def bench_calculate_scores(variant, n, min_time):
+    boundary, neighborhood = variant
+    engine = PDEngine(n=n, seed=0, boundary=boundary, neighborhood=neighborhood)
+    return _timed({'bench': 'calculate_scores', 'boundary': boundary,
+                   'neighborhood': neighborhood, 'n': n},
+                  engine.calculate_scores, min_time, cells=n * n)
+
+
+def bench_cluster_stats(regime, n, min_time):
+    engine = PDEngine(n=n, seed=0)
+    rng = np.random.RandomState(0)
+    engine.grid = (rng.random_sample((n, n)) < CLUSTER_REGIMES[regime]).astype(np.uint8)
+    return _timed({'bench': 'cluster_stats', 'regime': regime, 'n': n},
+                  engine.get_cluster_stats, min_time, cells=n * n)
+
+
+def bench_render(variant, n, min_time):
+    # What the GUIs' update_plot does per frame, on an off-screen canvas
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.colors import ListedColormap
+    from matplotlib.figure import Figure
+
+    from pd_render import GridRenderer
+
+    fig = Figure(figsize=(12, 6))
+    canvas = FigureCanvasAgg(fig)
+    grid_ax = fig.add_subplot(121)
+    ts_ax = fig.add_subplot(122)
+    ts_line, = ts_ax.plot([], [], 'b-')
+    renderer = GridRenderer(canvas, grid_ax, ts_ax, ts_line,
+                            ListedColormap(['red', 'blue', 'yellow', 'green']))
+    engine = PDEngine(n=n, seed=0)
+    engine.run(5)
+    renderer.render(engine.grid, engine.prev_grid, engine.ts_data, '')
+
+    def frame():
+        renderer.render(engine.grid, engine.prev_grid, engine.ts_data, 'stats')
+
+    return _timed({'bench': 'render', 'n': n}, frame, min_time, cells=n * n, unit='frames')
+
+
+def bench_tournament(variant, n, min_time):
+    # Imported here so that the lattice benchmarks do not need colorama
+    import titfortat
+
+    k, rounds = variant
+    players = titfortat.players[:k]
+    return _timed({'bench': 'tournament', 'players': k, 'rounds': rounds},
+                  lambda: titfortat.tournament(players, rounds, verbose=False),
+                  min_time, items=k * (k + 1) // 2, unit='matches')
+
+
+# name: (function, variants, whether it runs at every lattice size)
+BENCHMARKS = {
+    'update_grid': (bench_update_grid, MODES, True),
+    'calculate_scores': (bench_calculate_scores,
+                         [(b, nb) for b in BOUNDARIES for nb in NEIGHBORHOODS], True),
+    'cluster_stats': (bench_cluster_stats, tuple(CLUSTER_REGIMES), True),
+    'render': (bench_render, (None,), True),
+    'tournament': (bench_tournament,
+                   [(k, rounds) for k in TOURNAMENT_PLAYERS for rounds in TOURNAMENT_ROUNDS], False),
+}
+
+
+def run_case(name, variant, n, min_time):
+    # One result row, with the peak RSS of the process that produced it
+    fn = BENCHMARKS[name][0]
+    row = fn(variant, n, min_time)
+    # ru_maxrss is in kilobytes on Linux
+    row['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return row
+
+
+def cases(benchmarks, sizes):
+    for name in benchmarks:
+        _, variants, sized = BENCHMARKS[name]
+        for n in (sizes if sized else [None]):
+            for variant in variants:
+                yield name, variant, n
+
+
+def environment():
+    try:
+        # The commit of the code being measured, wherever this is run from
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+    }
+
+
+def run_benchmarks(benchmarks=tuple(BENCHMARKS), sizes=SIZES, min_time=1.0, isolate=True,
+                   log=None):
+    # With isolate, each case runs in a fresh process so that its peak RSS
+    # is its own and not the largest one measured so far
+    results = []
+    for name, variant, n in cases(benchmarks, sizes):
+        if isolate:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                row = pool.submit(run_case, name, variant, n, min_time).result()
+        else:
+            row = run_case(name, variant, n, min_time)
+        results.append(row)
+        if log is not None:
+            log(format_row(row))
+    return results
+
+
+def row_key(row):
+    # The fields describing the case, which come before the measurements
+    key = []
+    for k, v in row.items():
+        if k == 'best_s':
+            break
+        key.append((k, v))
+    return tuple(key)
+
+
+def format_row(row, baseline=None):
+    label = ' '.join(f'{k}={v}' for k, v in row_key(row))
+    text = f'{label:<64} {1e3 * row["median_s"]:10.3f} ms  {row["peak_rss_mb"]:8.1f} MB'
+    if baseline is not None:
+        text += f'  x{baseline["median_s"] / row["median_s"]:.2f}'
+    return text
+
+
+def compare(results, baseline):
+    # Speedup of every case against the same case in a previous run
+    previous = {row_key(row): row for row in baseline['results']}
+    return [format_row(row, previous.get(row_key(row))) for row in results]
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description="Benchmark the lattice and tournament hot paths.")
+    p.add_argument('--bench', nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    p.add_argument('--sizes', nargs='+', type=int, default=None,
+                   help=f"lattice sizes n (default {' '.join(map(str, SIZES))})")
+    p.add_argument('--quick', action='store_true',
+                   help="default to n = 100 and 500 and 0.2 s per case")
+    p.add_argument('--min-time', type=float, default=None,
+                   help="seconds spent timing each case (default 1)")
+    p.add_argument('--no-isolate', action='store_true',
+                   help="run every case in this process, peak RSS then only grows")
+    p.add_argument('--compare', metavar='JSON', help="print speedups against an earlier run")
+    p.add_argument('-o', '--output', default=None, help="JSON results file")
+    return p
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # --quick only changes the defaults, explicit values win
+    sizes = args.sizes or ([100, 500] if args.quick else list(SIZES))
+    min_time = args.min_time
+    if min_time is None:
+        min_time = 0.2 if args.quick else 1.0
+    results = run_benchmarks(args.bench, sizes, min_time, not args.no_isolate,
+                             log=None if args.compare else print)
+    if args.compare:
+        with open(args.compare) as f:
+            for line in compare(results, json.load(f)):
+                print(line)
+    if args.output:
+        report = {'environment': environment(), 'sizes': sizes, 'min_time': min_time,
+                  'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f"{len(results)} results in {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
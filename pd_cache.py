@@ -0,0 +1,80 @@
+import base64
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+def pack_moves(moves1, moves2):
+    # Both move sequences (1 = cooperate) as one base64 string, 8 moves a byte
+    bits = np.packbits(np.array([moves1, moves2], dtype=np.uint8), axis=-1)
+    return base64.b64encode(bits.tobytes()).decode('ascii')
+
+
+def unpack_moves(packed, rounds):
+    bits = np.frombuffer(base64.b64decode(packed), dtype=np.uint8).reshape(2, -1)
+    moves = np.unpackbits(bits, axis=-1, count=rounds)
+    return moves[0], moves[1]
+
+
+class MatchCache:
+    # Scores (and optionally the packed move histories) of deterministic
+    # matches, keyed by a tuple of JSON-able values that identifies the match.
+    # Least recently used entries are evicted beyond max_entries. With a
+    # path, entries are loaded from it and save() writes them back.
+    def __init__(self, path=None, max_entries=10000, histories=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.histories = histories
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def _key(key):
+        return json.dumps(list(key))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self._key(key) in self.entries
+
+    def get(self, key):
+        key = self._key(key)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, score1, score2, moves1=None, moves2=None):
+        entry = {'scores': [score1, score2]}
+        if self.histories and moves1 is not None:
+            entry['moves'] = pack_moves(moves1, moves2)
+        key = self._key(key)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+    def load(self):
+        with open(self.path) as f:
+            for key, entry in json.load(f):
+                self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        # Write a temporary file and swap it in, so an interrupted save never
+        # leaves a truncated cache behind
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(list(self.entries.items()), f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,109 @@
+import json
+import os
+
+import numpy as np
+
+from pd_engine import CycleDetector, PDEngine
+from pd_lattice import CellRNG
+from pd_neighborhood import Neighborhood
+
+# A checkpoint is one .npz file holding the engine's parameters (as JSON),
+# grid, prev_grid, generation, ts_data, the state of its random number
+# generators and of its cycle detector. Loading it gives an engine that
+# continues exactly as the saved one would have.
+PARAMS = ('n', 'b', 'neighborhood', 'boundary', 'initial_config', 'strategy_mode', 'seed',
+          'tie_break', 'incremental', 'stats_every', 'tft_threshold', 'cycle_window')
+
+
+def save_checkpoint(engine, path):
+    params = {name: getattr(engine, name) for name in PARAMS}
+    if isinstance(params['neighborhood'], Neighborhood):
+        params['neighborhood'] = [list(o) for o in params['neighborhood'].offsets]
+    # An engine without a seed draws from numpy's global state
+    _, keys, pos, has_gauss, gauss = engine.rng.get_state()
+    arrays = {
+        'params': np.array(json.dumps(params)),
+        'grid': engine.grid,
+        'generation': np.int64(engine.generation),
+        'ts_data': np.asarray(engine.ts_data, dtype=np.float64),
+        'rng_keys': keys,
+        'rng_pos': np.int64(pos),
+        'rng_gauss': np.array([has_gauss, gauss], dtype=np.float64),
+    }
+    if engine.prev_grid is not None:
+        arrays['prev_grid'] = engine.prev_grid
+    if isinstance(engine.tie_rng, CellRNG):
+        arrays['tie_seed'] = np.uint64(engine.tie_rng.seed)
+    if engine._cycles is not None:
+        # The cycle detector's window, so a resumed run settles when the
+        # uninterrupted one would have; -1 stands for None
+        arrays['cycle_hashes'] = np.array(engine._cycles.hashes, dtype=np.uint64)
+        arrays['cycle_state'] = np.array([engine._cycles.streak,
+                                          -1 if engine.period is None else engine.period,
+                                          -1 if engine.settled_at is None else engine.settled_at],
+                                         dtype=np.int64)
+    # Write a temporary file and swap it in, so an interrupted save never
+    # leaves a truncated checkpoint behind
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, **overrides):
+    # `overrides` replace saved parameters, e.g. b=1.9 to continue the run
+    # under a different temptation. A new seed starts fresh random streams
+    # instead of restoring the saved ones.
+    with np.load(path) as data:
+        params = json.loads(str(data['params']))
+        if isinstance(params['neighborhood'], list):
+            params['neighborhood'] = Neighborhood(params['neighborhood'])
+        params.update(overrides)
+        # Building the engine draws a throwaway initial grid, from numpy's
+        # global state when it has no seed; put that state back
+        global_state = np.random.get_state()
+        engine = PDEngine(**params)
+        np.random.set_state(global_state)
+        engine.grid = data['grid'].copy()
+        engine.prev_grid = data['prev_grid'].copy() if 'prev_grid' in data else None
+        engine.generation = int(data['generation'])
+        engine.ts_data = list(data['ts_data'])
+        if engine._cycles is not None:
+            if 'cycle_hashes' in data:
+                engine._cycles.hashes.extend(int(h) for h in data['cycle_hashes'])
+                streak, period, settled_at = (int(v) for v in data['cycle_state'])
+                engine._cycles.streak = streak
+                engine.period = None if period < 0 else period
+                engine.settled_at = None if settled_at < 0 else settled_at
+            else:
+                # Start watching from the loaded grid instead of the throwaway one
+                engine._cycles = CycleDetector(engine.cycle_window)
+                engine._cycles.update(engine.grid, deterministic=False)
+        if 'seed' in overrides:
+            return engine
+        engine.rng = np.random.RandomState()
+        has_gauss, gauss = data['rng_gauss']
+        engine.rng.set_state(('MT19937', data['rng_keys'], int(data['rng_pos']), int(has_gauss), gauss))
+        if 'tie_seed' in data:
+            engine.tie_rng = CellRNG(int(data['tie_seed']))
+        else:
+            engine.tie_rng = engine.rng
+    return engine
+
+
+def fork_checkpoint(path, bs, **overrides):
+    # One engine per value of b, all continuing from the same checkpoint and
+    # the same random state, so a shared burn-in is only simulated once
+    return [load_checkpoint(path, b=b, **overrides) for b in bs]
+
+
+class Checkpointer:
+    # engine.run callback saving a checkpoint to `path` every `every`
+    # generations, each save replacing the previous one
+    def __init__(self, path, every=1000):
+        self.path = path
+        self.every = every
+
+    def __call__(self, engine):
+        if engine.generation % self.every == 0:
+            save_checkpoint(engine, self.path)
@@ -0,0 +1,84 @@
+import numpy as np
+from scipy.ndimage import label
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from pd_neighborhood import get_neighborhood
+
+# Without a neighborhood, cells touching in any of the 8 directions belong to
+# the same cluster
+STRUCTURE = np.ones((3, 3))
+
+
+def label_clusters(grid, strategy=1, neighborhood=None):
+    # Cells of `strategy` are connected when they are neighbors. Clusters do
+    # not wrap around a periodic boundary.
+    mask = grid == strategy
+    if neighborhood is None:
+        return label(mask, structure=STRUCTURE)
+    nb = get_neighborhood(neighborhood)
+    if nb.radius == 1 and np.array_equal(nb.footprint, nb.footprint[::-1, ::-1]):
+        return label(mask, structure=nb.footprint)
+    return _label_graph(mask, nb)
+
+
+def _label_graph(mask, nb):
+    # Connected components over the neighbor pairs, for neighborhoods that
+    # ndimage.label cannot express as a 3x3 structure
+    n, m = mask.shape
+    ids = np.full(mask.shape, -1, dtype=np.int64)
+    ids[mask] = np.arange(np.count_nonzero(mask))
+    rows, cols = [], []
+    for di, dj in nb.offsets:
+        if (di, dj) == (0, 0):
+            continue
+        a = ids[max(0, -di):n - max(0, di), max(0, -dj):m - max(0, dj)]
+        b = ids[max(0, di):n - max(0, -di), max(0, dj):m - max(0, -dj)]
+        both = (a >= 0) & (b >= 0)
+        rows.append(a[both])
+        cols.append(b[both])
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int64)
+    size = int(mask.sum())
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(size, size))
+    n_clusters, labels = connected_components(graph, directed=True, connection='weak')
+    labeled = np.zeros(mask.shape, dtype=np.int32)
+    labeled[mask] = labels + 1
+    return labeled, n_clusters
+
+
+def cluster_sizes(labeled, n_clusters):
+    # Sizes of clusters 1..n_clusters in a single pass over the labels
+    return np.bincount(labeled.ravel(), minlength=n_clusters + 1)[1:]
+
+
+def percolates(labeled):
+    # True when one cluster connects opposite edges of the lattice
+    rows = np.intersect1d(labeled[0], labeled[-1])
+    cols = np.intersect1d(labeled[:, 0], labeled[:, -1])
+    return bool(np.any(rows > 0) or np.any(cols > 0))
+
+
+def cluster_stats(grid, strategy=1, neighborhood=None):
+    labeled, n_clusters = label_clusters(grid, strategy, neighborhood)
+    sizes = cluster_sizes(labeled, n_clusters)
+    return {
+        'avg_c_size': sizes.mean() if n_clusters else 0,
+        'max_c_size': sizes.max() if n_clusters else 0,
+        'n_clusters': n_clusters
+    }
+
+
+def cluster_distribution(grid, strategy=1, neighborhood=None):
+    # Full picture of the clusters of one strategy (1 = C, 0 = D):
+    # histogram[s] is the number of clusters of size s
+    labeled, n_clusters = label_clusters(grid, strategy, neighborhood)
+    sizes = cluster_sizes(labeled, n_clusters)
+    return {
+        'sizes': sizes,
+        'histogram': np.bincount(sizes),
+        'n_clusters': n_clusters,
+        'avg_size': sizes.mean() if n_clusters else 0,
+        'max_size': sizes.max() if n_clusters else 0,
+        'percolates': percolates(labeled),
+    }
@@ -0,0 +1,565 @@
+import argparse
+import json
+import os
+import sys
+from collections import deque
+
+import numpy as np
+from pd_clusters import cluster_distribution, cluster_stats
+from pd_lattice import (CellRNG, frontier, grid_hash, imitate_best, imitate_best_at,
+                        lattice_scores, pack_grid, score_ranks, tft_update)
+from pd_neighborhood import get_neighborhood
+
+# Update rules understood by the engine. The GUIs use a few different names
+# for the same rule, they are all accepted here.
+MODE_ALIASES = {
+    'local': 'imitate_best',
+    'always_c': 'pure_c',
+    'always_d': 'pure_d',
+}
+MODES = ('imitate_best', 'pure_c', 'pure_d', 'tft')
+
+METRIC_FIELDS = ('generation', 'coop_frac', 'avg_c_size', 'max_c_size', 'n_clusters')
+ENSEMBLE_FIELDS = ('generation', 'coop_frac_mean', 'coop_frac_std', 'coop_frac_sem')
+
+# When the cells that may change could be more than this fraction of the
+# lattice, the incremental mode falls back to a full update, which is then
+# cheaper than the gathers of the sparse one. On a 1000 x 1000 lattice a
+# sparse update costs about as much as a full one at 10-15% active cells
+# (less when they are scattered), so stay well below.
+FRONTIER_DENSE_FRACTION = 0.05
+
+
+class CycleDetector:
+    # Keeps the hashes of the last max_period + 1 grids. A grid equal to the
+    # one p <= max_period generations back is an attractor of period p (1 for
+    # a frozen lattice), provided none of the last p updates depended on a
+    # tie break: only then is the next generation bound to repeat as well.
+    def __init__(self, max_period=8):
+        self.max_period = max_period
+        self.hashes = deque(maxlen=max_period + 1)
+        # Deterministic updates in a row, ending with the latest
+        self.streak = 0
+
+    def update(self, grid, deterministic=True):
+        # Returns the period once grid closes a cycle, None until then
+        h = grid_hash(grid)
+        self.streak = self.streak + 1 if deterministic else 0
+        period = None
+        for p in range(1, min(self.streak, len(self.hashes)) + 1):
+            if self.hashes[-p] == h:
+                period = p
+                break
+        self.hashes.append(h)
+        return period
+
+
+class PDEngine:
+    # Spatial Prisoner's Dilemma on an n x n lattice, without any GUI.
+    #
+    # tie_break='sequential' draws the imitation ties from self.rng in
+    # row-major order, like the original loop. 'hashed' derives each cell's
+    # draw from (seed, generation, cell) instead, which is what lets
+    # incremental=True only revisit the cells near last generation's changes
+    # and still give bit-identical results to the full update.
+    #
+    # Cluster statistics are recomputed every `stats_every` generations by
+    # latest_cluster_stats and metrics, get_cluster_stats always recomputes.
+    #
+    # In 'tft' mode a cell defects when at least tft_threshold cells of its
+    # neighborhood defected last generation, None meaning a strict majority.
+    #
+    # With cycle_window=K the engine watches for fixed points and cycles of
+    # up to K generations. Once one is reached `period` is set, run() stops
+    # early and skip_to() jumps ahead without simulating the repeats.
+    def __init__(self, n=100, b=1.8, neighborhood='Moore', boundary='periodic',
+                 initial_config='random', strategy_mode='imitate_best', seed=None,
+                 tie_break=None, incremental=False, stats_every=1, tft_threshold=None,
+                 cycle_window=None):
+        self.n = n
+        self.b = b
+        self.neighborhood = neighborhood
+        self.boundary = boundary
+        self.initial_config = initial_config
+        self.strategy_mode = strategy_mode
+        self.tft_threshold = tft_threshold
+        self.seed = seed
+        # Without a seed the engine shares numpy's global random state, like
+        # the original simulators did
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
+
+        if tie_break is None:
+            tie_break = 'hashed' if incremental else 'sequential'
+        if incremental and tie_break != 'hashed':
+            raise ValueError("incremental updates need tie_break='hashed'")
+        self.tie_break = tie_break
+        self.incremental = incremental
+        self.stats_every = stats_every
+        self.cycle_window = cycle_window
+        if tie_break == 'hashed':
+            cell_seed = seed if seed is not None else np.random.SeedSequence().entropy
+            self.tie_rng = CellRNG(cell_seed)
+        else:
+            self.tie_rng = self.rng
+        self.reset()
+
+    @property
+    def rule(self):
+        return MODE_ALIASES.get(self.strategy_mode, self.strategy_mode)
+
+    def initialize_grid(self):
+        # Strategies are stored as uint8, 1 for C and 0 for D
+        if self.initial_config == 'random':
+            grid = self.rng.choice([0, 1], size=(self.n, self.n)).astype(np.uint8)
+        else:  # 'single_d'
+            grid = np.ones((self.n, self.n), dtype=np.uint8)
+            grid[self.n//2, self.n//2] = 0
+
+        if self.rule == 'pure_c':
+            return np.ones_like(grid)
+        elif self.rule == 'pure_d':
+            return np.zeros_like(grid)
+        return grid
+
+    def reset(self):
+        self.grid = self.initialize_grid()
+        self.prev_grid = None
+        self.generation = 0
+        self.ts_data = [np.mean(self.grid)]
+        self._frontier_state = None
+        self._cluster_stats = None
+        self.period = None
+        self.settled_at = None
+        self._cycles = None
+        if self.cycle_window:
+            self._cycles = CycleDetector(self.cycle_window)
+            self._cycles.update(self.grid, deterministic=False)
+        # Whether the last update was free of tie breaks that mattered
+        self._deterministic = True
+
+    def calculate_scores(self):
+        return lattice_scores(self.grid, self.b, self.neighborhood, self.boundary)
+
+    def calculate_score_ranks(self):
+        # Same ordering as calculate_scores, as uint8 ranks
+        return score_ranks(self.grid, self.b, self.neighborhood, self.boundary)
+
+    def packed_grid(self):
+        return pack_grid(self.grid)
+
+    def update_grid(self):
+        rule = self.rule
+        self.prev_grid = self.grid.copy()
+        self._deterministic = True
+        if rule == 'tft':
+            self.grid = tft_update(self.prev_grid, self.neighborhood, self.boundary, self.tft_threshold)
+        elif rule == 'pure_c':
+            self.grid = np.ones_like(self.grid)
+        elif rule == 'pure_d':
+            self.grid = np.zeros_like(self.grid)
+        else:
+            if self.tie_break == 'hashed':
+                self.tie_rng.generation = self.generation
+            if self.incremental:
+                self._update_frontier()
+                mixed = self._frontier_state[2]
+                self._deterministic = mixed is not None and not mixed.any()
+            elif self._cycles is not None:
+                scores = self.calculate_score_ranks()
+                self.grid, mixed = imitate_best(self.prev_grid, scores, self.boundary, self.tie_rng,
+                                                return_mixed=True, neighborhood=self.neighborhood)
+                self._deterministic = not mixed.any()
+            else:
+                scores = self.calculate_score_ranks()
+                self.grid = imitate_best(self.prev_grid, scores, self.boundary, self.tie_rng,
+                                         neighborhood=self.neighborhood)
+
+    def _update_frontier(self):
+        # Only cells within two steps of last generation's changes, or whose
+        # outcome hinged on the tie break, can change; everything else is
+        # carried over. self.prev_grid already holds the current state.
+        params = (self.b, self.neighborhood, self.boundary)
+        spread = len(get_neighborhood(self.neighborhood).frontier_offsets)
+        limit = FRONTIER_DENSE_FRACTION * self.grid.size
+        state = self._frontier_state
+        active = None
+        if state is not None and state[0] == params and state[2] is not None:
+            _, changed, mixed = state
+            # Bound the active cells before building the frontier, which costs
+            # a good part of a full update itself
+            if len(changed) * spread + np.count_nonzero(mixed) <= limit:
+                active = np.flatnonzero(frontier(changed, self.grid.shape, self.boundary,
+                                                 self.neighborhood) | mixed)
+
+        if active is None:
+            scores = self.calculate_score_ranks()
+            if self._cycles is None and state is not None and len(state[1]) * spread > limit:
+                # A lattice this busy will most likely need a full update next
+                # generation too, skip the tie-dependent cells only a sparse
+                # one would use (without them the next update is a full one)
+                self.grid = imitate_best(self.prev_grid, scores, self.boundary, self.tie_rng,
+                                         neighborhood=self.neighborhood)
+                mixed = None
+            else:
+                self.grid, mixed = imitate_best(self.prev_grid, scores, self.boundary,
+                                                self.tie_rng, return_mixed=True,
+                                                neighborhood=self.neighborhood)
+            changed = np.flatnonzero(self.grid != self.prev_grid)
+        else:
+            values, active_mixed = imitate_best_at(self.prev_grid, self.b, self.neighborhood,
+                                                   self.boundary, active, self.tie_rng)
+            flat = self.grid.reshape(-1)
+            changed = active[values != flat[active]]
+            flat[active] = values
+            mixed.reshape(-1)[active] = active_mixed
+        self._frontier_state = (params, changed, mixed)
+
+    def step(self):
+        self.update_grid()
+        self.generation += 1
+        self.ts_data.append(np.mean(self.grid))
+        if self._cycles is not None and self.period is None:
+            self.period = self._cycles.update(self.grid, self._deterministic)
+            if self.period is not None:
+                self.settled_at = self.generation
+
+    def run(self, generations, callback=None):
+        # Stops early once an attractor is found, see cycle_window
+        for _ in range(generations):
+            self.step()
+            if callback is not None:
+                callback(self)
+            if self.period is not None:
+                break
+
+    def skip_to(self, generation):
+        # After an attractor is found, go to `generation` as if every
+        # generation in between had been simulated: the grid is stepped to
+        # the right phase of the cycle and ts_data repeats the cycle.
+        if self.period is None:
+            raise ValueError("no attractor found yet")
+        if generation <= self.generation:
+            return
+        for _ in range((generation - self.generation) % self.period):
+            self.step()
+        while len(self.ts_data) <= generation:
+            self.ts_data.append(self.ts_data[-self.period])
+        self.generation = generation
+
+    def get_cluster_stats(self):
+        return cluster_stats(self.grid, neighborhood=self.neighborhood)
+
+    def stats_due(self):
+        return self.generation % self.stats_every == 0
+
+    def latest_cluster_stats(self):
+        # Stats as of the last generation on the stats_every cadence
+        if self._cluster_stats is None or (self.stats_due() and self._cluster_stats[0] != self.generation):
+            self._cluster_stats = (self.generation, self.get_cluster_stats())
+        return self._cluster_stats[1]
+
+    def cluster_distributions(self):
+        # Size distributions of the cooperator and defector clusters
+        return {'C': cluster_distribution(self.grid, 1, self.neighborhood),
+                'D': cluster_distribution(self.grid, 0, self.neighborhood)}
+
+    def metrics(self, cluster_stats=True):
+        # Cluster fields are only present on generations where they are due
+        row = {'generation': self.generation, 'coop_frac': float(self.ts_data[-1])}
+        if cluster_stats and self.stats_due():
+            row.update({k: float(v) if k == 'avg_c_size' else int(v)
+                        for k, v in self.latest_cluster_stats().items()})
+        return row
+
+
+class PDEnsemble:
+    # R independent replicas at the same parameters, stored as one (R, n, n)
+    # array and advanced together. Replica r draws from its own RandomState
+    # seeded with seeds[r], so it evolves exactly like PDEngine(seed=seeds[r]).
+    # tft_threshold may also hold one threshold per replica, to sweep the
+    # 'tft' variants in bulk.
+    def __init__(self, replicas=100, n=100, b=1.8, neighborhood='Moore', boundary='periodic',
+                 initial_config='random', strategy_mode='imitate_best', seeds=None,
+                 tft_threshold=None):
+        self.n = n
+        self.b = b
+        self.neighborhood = neighborhood
+        self.boundary = boundary
+        self.initial_config = initial_config
+        self.strategy_mode = strategy_mode
+        self.tft_threshold = tft_threshold
+        if seeds is None:
+            seeds = np.random.SeedSequence().generate_state(replicas)
+        if len(seeds) != replicas:
+            raise ValueError(f"expected {replicas} seeds, got {len(seeds)}")
+        self.seeds = [int(s) for s in seeds]
+        self.rngs = [np.random.RandomState(s) for s in self.seeds]
+        self.reset()
+
+    @property
+    def replicas(self):
+        return len(self.rngs)
+
+    @property
+    def rule(self):
+        return MODE_ALIASES.get(self.strategy_mode, self.strategy_mode)
+
+    def initialize_grid(self):
+        shape = (self.replicas, self.n, self.n)
+        if self.initial_config == 'random':
+            grid = np.stack([rng.choice([0, 1], size=(self.n, self.n)).astype(np.uint8)
+                             for rng in self.rngs])
+        else:  # 'single_d'
+            grid = np.ones(shape, dtype=np.uint8)
+            grid[:, self.n//2, self.n//2] = 0
+
+        if self.rule == 'pure_c':
+            return np.ones_like(grid)
+        elif self.rule == 'pure_d':
+            return np.zeros_like(grid)
+        return grid
+
+    def reset(self):
+        self.grid = self.initialize_grid()
+        self.prev_grid = None
+        self.generation = 0
+        self.ts_data = [self.coop_fracs()]
+
+    def coop_fracs(self):
+        return self.grid.mean(axis=(1, 2))
+
+    def calculate_scores(self):
+        return lattice_scores(self.grid, self.b, self.neighborhood, self.boundary)
+
+    def update_grid(self):
+        self.prev_grid = self.grid.copy()
+        if self.rule == 'tft':
+            threshold = self.tft_threshold
+            if threshold is not None:
+                threshold = np.reshape(threshold, (-1, 1, 1))
+            self.grid = tft_update(self.prev_grid, self.neighborhood, self.boundary, threshold)
+        elif self.rule == 'pure_c':
+            self.grid = np.ones_like(self.grid)
+        elif self.rule == 'pure_d':
+            self.grid = np.zeros_like(self.grid)
+        else:
+            scores = score_ranks(self.grid, self.b, self.neighborhood, self.boundary)
+            self.grid = imitate_best(self.prev_grid, scores, self.boundary, self.rngs,
+                                     neighborhood=self.neighborhood)
+
+    def step(self):
+        self.update_grid()
+        self.generation += 1
+        self.ts_data.append(self.coop_fracs())
+
+    def run(self, generations, callback=None):
+        for _ in range(generations):
+            self.step()
+            if callback is not None:
+                callback(self)
+
+    def trajectories(self):
+        # Cooperator fraction per generation (rows) and replica (columns)
+        return np.array(self.ts_data)
+
+    def metrics(self):
+        fracs = self.ts_data[-1]
+        std = float(np.std(fracs, ddof=1)) if len(fracs) > 1 else 0.0
+        return {
+            'generation': self.generation,
+            'coop_frac_mean': float(np.mean(fracs)),
+            'coop_frac_std': std,
+            'coop_frac_sem': std / np.sqrt(len(fracs)),
+        }
+
+
+class MetricsWriter:
+    # Streams one row of metrics per generation as CSV or JSON lines.
+    # header=False continues a CSV file that already has its header.
+    def __init__(self, out, fmt='csv', fields=METRIC_FIELDS, header=True):
+        self.out = out
+        self.fmt = fmt
+        self.fields = fields
+        if fmt == 'csv' and header:
+            self.out.write(','.join(fields) + '\n')
+
+    def write(self, row):
+        if self.fmt == 'csv':
+            self.out.write(','.join(str(row.get(f, '')) for f in self.fields) + '\n')
+        else:
+            self.out.write(json.dumps(row) + '\n')
+        self.out.flush()
+
+
+def continue_metrics(path, fmt, fields, generation):
+    # Opens the metrics file of a resumed run for appending, cut back to the
+    # rows up to `generation` like TrajectoryRecorder does with a recording:
+    # rows written after the checkpoint, e.g. by a run that crashed later,
+    # are dropped so the file reads as one uninterrupted run.
+    with open(path) as f:
+        lines = f.readlines()
+    keep = generation + 1
+    if fmt == 'csv':
+        if not lines or lines[0].rstrip('\n') != ','.join(fields):
+            raise ValueError(f"{path} holds different metric columns")
+        keep += 1
+    if len(lines) < keep or not lines[keep - 1].endswith('\n'):
+        raise ValueError(f"{path} ends before generation {generation}, cannot continue it")
+    with open(path, 'w') as f:
+        f.writelines(lines[:keep])
+    return open(path, 'a')
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description="Run the spatial PD lattice without a GUI.")
+    p.add_argument('--n', type=int, default=100, help="grid size")
+    p.add_argument('--b', type=float, default=1.8, help="temptation to defect")
+    p.add_argument('--generations', type=int, default=100)
+    p.add_argument('--neighborhood', default='Moore',
+                   help="Moore, vonNeumann or hexagonal, with an optional radius as in Moore:2")
+    p.add_argument('--boundary', default='periodic', choices=['periodic', 'fixed'])
+    p.add_argument('--initial-config', default='random', choices=['random', 'single_d'])
+    p.add_argument('--mode', default='imitate_best', choices=list(MODES) + list(MODE_ALIASES))
+    p.add_argument('--seed', type=int, default=None)
+    p.add_argument('--tie-break', default=None, choices=['sequential', 'hashed'],
+                   help="defaults to 'hashed' with --incremental, 'sequential' otherwise")
+    p.add_argument('--tft-threshold', type=int, default=None,
+                   help="in tft mode, defect when at least this many neighbors defected "
+                        "(default: a strict majority)")
+    p.add_argument('--incremental', action='store_true',
+                   help="only update the cells around last generation's changes")
+    p.add_argument('--workers', type=int, default=1,
+                   help="split the lattice into this many row strips stepped in parallel processes")
+    p.add_argument('--replicas', type=int, default=1,
+                   help="run this many independent replicas as one ensemble")
+    p.add_argument('--format', default='csv', choices=['csv', 'jsonl'])
+    p.add_argument('--no-cluster-stats', action='store_true',
+                   help="only report the cooperator fraction")
+    p.add_argument('--stats-every', type=int, default=1,
+                   help="compute cluster stats every this many generations")
+    p.add_argument('-o', '--output', default='-', help="metrics file, '-' for stdout")
+    p.add_argument('--stop-on-cycle', type=int, default=0, metavar='K',
+                   help="stop once the lattice freezes or cycles with a period of at most K")
+    p.add_argument('--checkpoint', metavar='FILE', help="save the run's state to this file")
+    p.add_argument('--checkpoint-every', type=int, default=1000,
+                   help="generations between checkpoints")
+    p.add_argument('--resume', metavar='FILE',
+                   help="continue the run saved in this checkpoint for --generations more "
+                        "generations, the lattice options are taken from the checkpoint")
+    p.add_argument('--record', metavar='DIR',
+                   help="also record every generation's grid and metrics to this directory")
+    return p
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.resume and args.workers > 1:
+        # Checkpoints restore a single-process PDEngine
+        parser.error("--resume cannot be combined with --workers")
+    if args.workers > 1:
+        # The strip workers always break ties with the hashed scheme and
+        # update every cell, without watching for attractors
+        if args.incremental or args.stop_on_cycle or args.tie_break == 'sequential':
+            parser.error("--workers cannot be combined with --incremental, --stop-on-cycle "
+                         "or --tie-break sequential")
+    if args.replicas > 1:
+        # The ensemble only reports the cooperator fraction of full updates
+        ignored = [flag for flag, value in (('--checkpoint', args.checkpoint),
+                                            ('--resume', args.resume),
+                                            ('--record', args.record),
+                                            ('--stop-on-cycle', args.stop_on_cycle),
+                                            ('--incremental', args.incremental),
+                                            ('--workers', args.workers > 1),
+                                            ('--tie-break', args.tie_break),
+                                            ('--stats-every', args.stats_every != 1),
+                                            ('--no-cluster-stats', args.no_cluster_stats))
+                   if value]
+        if ignored:
+            parser.error(f"--replicas cannot be combined with {', '.join(ignored)}")
+        return run_ensemble(args)
+
+    if args.resume:
+        # Imported here, pd_checkpoint builds on this module
+        from pd_checkpoint import load_checkpoint
+        engine = load_checkpoint(args.resume)
+    elif args.workers > 1:
+        # Imported here, pd_parallel builds on this module
+        from pd_parallel import StripEngine
+        engine = StripEngine(n=args.n, b=args.b, neighborhood=args.neighborhood,
+                             boundary=args.boundary, initial_config=args.initial_config,
+                             strategy_mode=args.mode, seed=args.seed,
+                             stats_every=args.stats_every, tft_threshold=args.tft_threshold,
+                             workers=args.workers)
+    else:
+        engine = PDEngine(n=args.n, b=args.b, neighborhood=args.neighborhood,
+                          boundary=args.boundary, initial_config=args.initial_config,
+                          strategy_mode=args.mode, seed=args.seed,
+                          tie_break=args.tie_break, incremental=args.incremental,
+                          stats_every=args.stats_every, tft_threshold=args.tft_threshold,
+                          cycle_window=args.stop_on_cycle or None)
+
+    with_stats = not args.no_cluster_stats
+    fields = METRIC_FIELDS if with_stats else METRIC_FIELDS[:2]
+    append = bool(args.resume) and args.output != '-' and os.path.exists(args.output)
+    if append:
+        out = continue_metrics(args.output, args.format, fields, engine.generation)
+    else:
+        out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    recorder = None
+    try:
+        writer = MetricsWriter(out, args.format, fields, header=not append)
+        if args.record:
+            # Imported here, pd_record builds on this module
+            from pd_record import TrajectoryRecorder
+            recorder = TrajectoryRecorder(args.record, engine, with_stats, append=bool(args.resume))
+        checkpointer = None
+        if args.checkpoint:
+            from pd_checkpoint import Checkpointer, save_checkpoint
+            checkpointer = Checkpointer(args.checkpoint, args.checkpoint_every)
+
+        def record(e):
+            writer.write(e.metrics(with_stats))
+            if recorder is not None:
+                recorder.record(e)
+            if checkpointer is not None:
+                checkpointer(e)
+
+        if not args.resume:
+            record(engine)
+        engine.run(args.generations, record)
+        if engine.period is not None:
+            print(f"attractor of period {engine.period} reached at generation {engine.settled_at}",
+                  file=sys.stderr)
+        if checkpointer is not None:
+            # The final state too, whatever the cadence
+            save_checkpoint(engine, args.checkpoint)
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if args.workers > 1:
+            engine.close()
+        if out is not sys.stdout:
+            out.close()
+
+
+def run_ensemble(args):
+    # Replica r is seeded with seed + r, a missing seed draws fresh entropy
+    seeds = None if args.seed is None else [args.seed + r for r in range(args.replicas)]
+    ensemble = PDEnsemble(replicas=args.replicas, n=args.n, b=args.b,
+                          neighborhood=args.neighborhood, boundary=args.boundary,
+                          initial_config=args.initial_config, strategy_mode=args.mode,
+                          seeds=seeds, tft_threshold=args.tft_threshold)
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        writer = MetricsWriter(out, args.format, ENSEMBLE_FIELDS)
+        writer.write(ensemble.metrics())
+        ensemble.run(args.generations, lambda e: writer.write(e.metrics()))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
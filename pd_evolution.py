@@ -0,0 +1,136 @@
+import argparse
+import sys
+
+import numpy as np
+
+from pd_engine import MetricsWriter
+
+PROCESSES = ('replicator', 'moran', 'wright_fisher')
+
+
+class Population:
+    # Evolution of strategy shares under a fixed payoff matrix, A[i, j] being
+    # what strategy i earns against strategy j. Finite populations are kept
+    # as one count per strategy and updated with multinomial draws, so the
+    # cost of a generation does not depend on the population size.
+    #
+    #   replicator     deterministic discrete-time replicator dynamics on shares
+    #   wright_fisher  the whole population is resampled every generation
+    #   moran          N birth-death events per generation, drawn in `leaps`
+    #                  batches with fitness frozen within a batch (leaps=N is
+    #                  the exact one-event-at-a-time Moran process)
+    #
+    # Fitness is 1 - selection + selection * expected payoff, so selection=0
+    # is neutral drift and selection=1 uses the payoffs as they are.
+    def __init__(self, payoffs, counts, process='moran', selection=1.0, leaps=100, seed=None):
+        if process not in PROCESSES:
+            raise ValueError(f"unknown process {process!r}, expected one of {PROCESSES}")
+        self.payoffs = np.asarray(payoffs, dtype=float)
+        self.process = process
+        self.selection = selection
+        self.leaps = leaps
+        self.rng = np.random.default_rng(seed)
+        self.generation = 0
+        if process == 'replicator':
+            counts = np.asarray(counts, dtype=float)
+            self.state = counts / counts.sum()
+        else:
+            self.state = np.asarray(counts, dtype=np.int64)
+        self.size = self.state.sum()
+
+    def shares(self):
+        return self.state / self.state.sum()
+
+    def expected_payoffs(self, counts):
+        if self.process == 'replicator':
+            return self.payoffs @ counts
+        # Average over the other N - 1 members, an agent does not play itself
+        n = counts.sum()
+        return (self.payoffs @ counts - np.diag(self.payoffs)) / max(1, n - 1)
+
+    def fitness(self, counts):
+        return 1 - self.selection + self.selection * self.expected_payoffs(counts)
+
+    def _birth_probabilities(self, counts):
+        weights = counts * self.fitness(counts)
+        total = weights.sum()
+        if total <= 0:
+            return counts / counts.sum()
+        return weights / total
+
+    def step(self):
+        if self.process == 'replicator':
+            self.state = self._birth_probabilities(self.state)
+        elif self.process == 'wright_fisher':
+            self.state = self.rng.multinomial(self.size, self._birth_probabilities(self.state))
+        else:
+            counts = self.state
+            leaps = max(1, min(self.leaps, self.size))
+            for events in np.diff(np.linspace(0, self.size, leaps + 1).astype(np.int64)):
+                births = self.rng.multinomial(events, self._birth_probabilities(counts))
+                deaths = self.rng.multivariate_hypergeometric(counts, events)
+                counts = counts + births - deaths
+            self.state = counts
+        self.generation += 1
+
+    def fixated(self):
+        return np.count_nonzero(self.state) == 1
+
+    def run(self, generations, callback=None):
+        for _ in range(generations):
+            self.step()
+            if callback is not None:
+                callback(self)
+
+
+def build_parser():
+    p = argparse.ArgumentParser(
+        description="Evolve the titfortat.py strategies over their pairwise tournament payoffs.")
+    p.add_argument('--process', default='moran', choices=PROCESSES)
+    p.add_argument('--population', type=int, default=100000, help="agents, split evenly at the start")
+    p.add_argument('--generations', type=int, default=1000)
+    p.add_argument('--selection', type=float, default=1.0, help="intensity of selection in [0, 1]")
+    p.add_argument('--leaps', type=int, default=100, help="birth-death batches per Moran generation")
+    p.add_argument('--rounds', type=int, default=100, help="rounds per match")
+    p.add_argument('--samples', type=int, default=200,
+                   help="matches averaged for each stochastic pairing")
+    p.add_argument('--seed', type=int, default=None)
+    p.add_argument('--format', default='csv', choices=['csv', 'jsonl'])
+    p.add_argument('-o', '--output', default='-', help="trajectory file, '-' for stdout")
+    return p
+
+
+def main(argv=None):
+    # Imported here so that Population does not pull in colorama
+    import titfortat
+
+    args = build_parser().parse_args(argv)
+    names = [titfortat.player_name(player) for player in titfortat.players]
+    payoffs = titfortat.pairwise_payoffs(titfortat.players, args.rounds, args.samples, seed=args.seed)
+    k = len(names)
+    counts = np.full(k, args.population // k)
+    counts[:args.population % k] += 1
+    population = Population(payoffs, counts, args.process, args.selection, args.leaps, args.seed)
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        writer = MetricsWriter(out, args.format, ('generation',) + tuple(names))
+
+        def record(pop):
+            row = {'generation': pop.generation}
+            row.update(zip(names, pop.shares().tolist()))
+            writer.write(row)
+
+        record(population)
+        for _ in range(args.generations):
+            population.step()
+            record(population)
+            if args.process != 'replicator' and population.fixated():
+                break
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
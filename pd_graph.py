@@ -0,0 +1,234 @@
+import argparse
+import sys
+
+import numpy as np
+from scipy.sparse import coo_matrix, identity
+from scipy.sparse.csgraph import connected_components
+
+from pd_engine import MODE_ALIASES, MODES, METRIC_FIELDS, MetricsWriter
+from pd_neighborhood import get_neighborhood
+
+
+# Graphs are scipy CSR adjacency matrices without self loops, one row per
+# node listing its neighbors.
+
+def from_edges(src, dst, n=None, directed=False):
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    if n is None:
+        n = int(max(src.max(initial=-1), dst.max(initial=-1))) + 1
+    if not directed:
+        src, dst = np.concatenate([src, dst]), np.concatenate([dst, src])
+    keep = src != dst
+    adj = coo_matrix((np.ones(np.count_nonzero(keep), dtype=np.int32), (src[keep], dst[keep])),
+                     shape=(n, n)).tocsr()
+    # Repeated edges count once
+    adj.sum_duplicates()
+    adj.data[:] = 1
+    return adj
+
+
+def load_edge_list(path, directed=False, delimiter=None, n=None):
+    # Two integer node ids per line, '#' starts a comment
+    edges = np.loadtxt(path, dtype=np.int64, comments='#', delimiter=delimiter,
+                       usecols=(0, 1), ndmin=2)
+    return from_edges(edges[:, 0], edges[:, 1], n, directed)
+
+
+def lattice_graph(n, neighborhood='Moore', boundary='periodic'):
+    # The n x n lattice of PDEngine as a graph, node i * n + j for cell (i, j)
+    nb = get_neighborhood(neighborhood)
+    i, j = np.divmod(np.arange(n * n), n)
+    src, dst = [], []
+    for di, dj in nb.forward_offsets:
+        ii, jj = i + di, j + dj
+        if boundary == 'periodic':
+            ii, jj = ii % n, jj % n
+            valid = np.ones(n * n, dtype=bool)
+        else:
+            valid = (ii >= 0) & (ii < n) & (jj >= 0) & (jj < n)
+        src.append(np.flatnonzero(valid))
+        dst.append((ii * n + jj)[valid])
+    return from_edges(np.concatenate(src), np.concatenate(dst), n * n)
+
+
+def watts_strogatz(n, k=4, p=0.1, seed=None):
+    # Ring of n nodes joined to their k nearest neighbors, each edge rewired
+    # to a uniformly random target with probability p
+    rng = np.random.default_rng(seed)
+    src = np.repeat(np.arange(n), k // 2)
+    dst = (src + np.tile(np.arange(1, k // 2 + 1), n)) % n
+    rewire = rng.random(len(src)) < p
+    dst[rewire] = rng.integers(0, n, np.count_nonzero(rewire))
+    return from_edges(src, dst, n)
+
+
+class GraphEngine:
+    # The spatial Prisoner's Dilemma with agents on the nodes of a graph.
+    # Same parameters, modes and metrics as PDEngine; `grid` is the 1-D
+    # strategy vector, one uint8 per node (1 = C, 0 = D).
+    #
+    # Like on the lattice, every agent plays with itself and its neighbors:
+    # cooperators earn 1 per cooperator and defectors b per cooperator, which
+    # is one sparse matrix-vector product. imitate_best then copies the best
+    # scoring member of each closed neighborhood, ties broken uniformly, with
+    # segmented reductions over the CSR rows instead of a loop over nodes.
+    def __init__(self, graph, b=1.8, initial_config='random', strategy_mode='imitate_best',
+                 seed=None, tft_threshold=None):
+        # Closed neighborhoods: the adjacency plus self loops
+        self.adjacency = (graph.tocsr().astype(np.int32) + identity(graph.shape[0], dtype=np.int32,
+                                                                       format='csr')).tocsr()
+        self.adjacency.sum_duplicates()
+        self.adjacency.data[:] = 1
+        self.n = graph.shape[0]
+        self.b = b
+        self.initial_config = initial_config
+        self.strategy_mode = strategy_mode
+        self.tft_threshold = tft_threshold
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
+        indptr = self.adjacency.indptr
+        self.sizes = np.diff(indptr)
+        self.starts = indptr[:-1]
+        # Row of every stored neighbor, for broadcasting per-node values
+        self.rows = np.repeat(np.arange(self.n), self.sizes)
+        self.reset()
+
+    @property
+    def rule(self):
+        return MODE_ALIASES.get(self.strategy_mode, self.strategy_mode)
+
+    def initialize_grid(self):
+        if self.initial_config == 'random':
+            grid = self.rng.choice([0, 1], size=self.n).astype(np.uint8)
+        else:  # 'single_d'
+            grid = np.ones(self.n, dtype=np.uint8)
+            grid[self.n // 2] = 0
+
+        if self.rule == 'pure_c':
+            return np.ones_like(grid)
+        elif self.rule == 'pure_d':
+            return np.zeros_like(grid)
+        return grid
+
+    def reset(self):
+        self.grid = self.initialize_grid()
+        self.prev_grid = None
+        self.generation = 0
+        self.ts_data = [np.mean(self.grid)]
+
+    def cooperator_counts(self, grid=None):
+        grid = self.grid if grid is None else grid
+        return self.adjacency @ grid.astype(np.int32)
+
+    def calculate_scores(self):
+        c_scores = self.cooperator_counts()
+        return np.where(self.grid == 1, c_scores, self.b * c_scores)
+
+    def imitate_best(self, scores):
+        indices = self.adjacency.indices
+        nbr_scores = scores[indices]
+        best = np.maximum.reduceat(nbr_scores, self.starts)
+        hit = nbr_scores == best[self.rows]
+        counts = np.add.reduceat(hit.astype(np.int32), self.starts)
+        pick = self.rng.randint(counts)
+        # Rank of every tied best neighbor within its row, then take the pick-th
+        rank = np.cumsum(hit) - 1
+        rank -= np.concatenate([[0], np.cumsum(counts)[:-1]])[self.rows]
+        chosen = np.flatnonzero(hit & (rank == pick[self.rows]))
+        return self.grid[indices[chosen]]
+
+    def tft_update(self):
+        defect = self.sizes - self.cooperator_counts()
+        if self.tft_threshold is None:
+            return (2 * defect <= self.sizes).astype(np.uint8)
+        return (defect < self.tft_threshold).astype(np.uint8)
+
+    def update_grid(self):
+        rule = self.rule
+        self.prev_grid = self.grid.copy()
+        if rule == 'tft':
+            self.grid = self.tft_update()
+        elif rule == 'pure_c':
+            self.grid = np.ones_like(self.grid)
+        elif rule == 'pure_d':
+            self.grid = np.zeros_like(self.grid)
+        else:
+            self.grid = self.imitate_best(self.calculate_scores())
+
+    def step(self):
+        self.update_grid()
+        self.generation += 1
+        self.ts_data.append(np.mean(self.grid))
+
+    def run(self, generations, callback=None):
+        for _ in range(generations):
+            self.step()
+            if callback is not None:
+                callback(self)
+
+    def get_cluster_stats(self):
+        # Connected components of the subgraph induced by the cooperators
+        coop = np.flatnonzero(self.grid == 1)
+        if len(coop) == 0:
+            return {'avg_c_size': 0, 'max_c_size': 0, 'n_clusters': 0}
+        sub = self.adjacency[coop][:, coop]
+        n_clusters, labels = connected_components(sub, directed=False)
+        sizes = np.bincount(labels)
+        return {'avg_c_size': sizes.mean(), 'max_c_size': sizes.max(), 'n_clusters': n_clusters}
+
+    def metrics(self, cluster_stats=True):
+        row = {'generation': self.generation, 'coop_frac': float(self.ts_data[-1])}
+        if cluster_stats:
+            row.update({k: float(v) if k == 'avg_c_size' else int(v)
+                        for k, v in self.get_cluster_stats().items()})
+        return row
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description="Run the spatial PD on an arbitrary graph.")
+    graph = p.add_mutually_exclusive_group(required=True)
+    graph.add_argument('--edges', help="edge list file, two node ids per line")
+    graph.add_argument('--lattice', type=int, metavar='N', help="the N x N lattice of pd_engine.py")
+    graph.add_argument('--small-world', type=int, metavar='N', help="Watts-Strogatz graph on N nodes")
+    p.add_argument('--directed', action='store_true', help="do not symmetrize the edge list")
+    p.add_argument('--k', type=int, default=4, help="small-world ring degree")
+    p.add_argument('--p', type=float, default=0.1, help="small-world rewiring probability")
+    p.add_argument('--neighborhood', default='Moore', help="lattice neighborhood")
+    p.add_argument('--boundary', default='periodic', choices=['periodic', 'fixed'])
+    p.add_argument('--b', type=float, default=1.8, help="temptation to defect")
+    p.add_argument('--generations', type=int, default=100)
+    p.add_argument('--initial-config', default='random', choices=['random', 'single_d'])
+    p.add_argument('--mode', default='imitate_best', choices=list(MODES) + list(MODE_ALIASES))
+    p.add_argument('--tft-threshold', type=int, default=None)
+    p.add_argument('--seed', type=int, default=None)
+    p.add_argument('--format', default='csv', choices=['csv', 'jsonl'])
+    p.add_argument('--no-cluster-stats', action='store_true')
+    p.add_argument('-o', '--output', default='-', help="metrics file, '-' for stdout")
+    return p
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.edges:
+        graph = load_edge_list(args.edges, args.directed)
+    elif args.lattice:
+        graph = lattice_graph(args.lattice, args.neighborhood, args.boundary)
+    else:
+        graph = watts_strogatz(args.small_world, args.k, args.p, args.seed)
+
+    engine = GraphEngine(graph, b=args.b, initial_config=args.initial_config,
+                         strategy_mode=args.mode, seed=args.seed, tft_threshold=args.tft_threshold)
+    with_stats = not args.no_cluster_stats
+    fields = METRIC_FIELDS if with_stats else METRIC_FIELDS[:2]
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        writer = MetricsWriter(out, args.format, fields)
+        writer.write(engine.metrics(with_stats))
+        engine.run(args.generations, lambda e: writer.write(e.metrics(with_stats)))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import hashlib
+
+import numpy as np
+from scipy.signal import fftconvolve
+
+from pd_neighborhood import get_neighborhood
+
+_MASK64 = (1 << 64) - 1
+
+# Rows per block when drawing tie breaks, bounds the int64 temporaries
+TIE_BLOCK_ROWS = 256
+
+# Grids hold one uint8 per cell, 1 for a cooperator and 0 for a defector.
+# All functions below work on the last two axes, so a stack of R replicas
+# with shape (R, n, n) is advanced in the same call as a single grid.
+# `neighborhood` is anything pd_neighborhood.get_neighborhood accepts, the
+# same neighborhood is used for playing, imitating and clustering.
+
+
+def _pad(a, boundary, fill_value=0, width=1):
+    pad_width = [(0, 0)] * (a.ndim - 2) + [(width, width), (width, width)]
+    if boundary == 'periodic':
+        return np.pad(a, pad_width, mode='wrap')
+    return np.pad(a, pad_width, mode='constant', constant_values=fill_value)
+
+
+def neighbor_count(grid, neighborhood, boundary):
+    # Number of cooperators in each cell's neighborhood, the cell included
+    nb = get_neighborhood(neighborhood)
+    if nb.use_fft:
+        return _fft_count(grid, nb, boundary)
+    n, m = grid.shape[-2:]
+    r = nb.radius
+    padded = _pad(grid.astype(nb.count_dtype, copy=False), boundary, width=r)
+    counts = np.zeros(grid.shape, dtype=nb.count_dtype)
+    for di, dj in nb.offsets:
+        counts += padded[..., r + di:r + di + n, r + dj:r + dj + m]
+    return counts
+
+
+def _fft_count(grid, nb, boundary):
+    # Same sums as one convolution with the neighborhood's footprint, whose
+    # cost does not grow with the number of offsets
+    padded = _pad(grid.astype(float), boundary, width=nb.radius)
+    kernel = nb.footprint[::-1, ::-1].astype(float).reshape((1,) * (grid.ndim - 2) + nb.footprint.shape)
+    counts = fftconvolve(padded, kernel, mode='valid', axes=(-2, -1))
+    return np.rint(counts).astype(nb.count_dtype)
+
+
+def lattice_scores(grid, b, neighborhood, boundary):
+    # Cooperators earn 1 per cooperating neighbor, defectors earn b
+    c_scores = neighbor_count(grid, neighborhood, boundary)
+    return np.where(grid == 1, c_scores, b * c_scores)
+
+
+def tft_update(grid, neighborhood, boundary, threshold=None):
+    # Neighborhood tit-for-tat: a cell defects when at least `threshold` cells
+    # of its neighborhood (itself included) defected last generation. The
+    # default is a strict majority of the cells inside the lattice. An array
+    # threshold broadcasting against the grid, e.g. shape (R, 1, 1) for a
+    # stack of replicas, runs several variants in one call.
+    n, m = grid.shape[-2:]
+    coop = neighbor_count(grid, neighborhood, boundary)
+    size = neighbor_count(np.ones((n, m), dtype=np.uint8), neighborhood, boundary)
+    defect = size - coop
+    if threshold is None:
+        return (2 * defect.astype(np.intp) <= size).astype(np.uint8)
+    return (defect < np.asarray(threshold)).astype(np.uint8)
+
+
+def score_ranks(grid, b, neighborhood, boundary):
+    # Payoffs only take a handful of distinct values (a cooperator or defector
+    # with 0..k cooperating neighbors), so each is replaced by its rank among
+    # them. The uint8 ranks order and tie exactly like the float payoffs of
+    # lattice_scores at an eighth of the memory. Ranks start at 1.
+    counts = neighbor_count(grid, neighborhood, boundary)
+    k = get_neighborhood(neighborhood).size + 1
+    payoffs = np.concatenate([b * np.arange(k), np.arange(k, dtype=float)])
+    _, ranks = np.unique(payoffs, return_inverse=True)
+    if 2 * k <= 255:
+        table = (ranks + 1).astype(np.uint8)
+        return table[grid * np.uint8(k) + counts]
+    table = (ranks + 1).astype(np.uint16)
+    return table[grid.astype(np.intp) * k + counts]
+
+
+def pack_grid(grid):
+    # 8 cells per byte along the last axis, for storing or shipping grids
+    return np.packbits(grid, axis=-1)
+
+
+def unpack_grid(packed, n):
+    return np.unpackbits(packed, axis=-1, count=n)
+
+
+def grid_hash(grid):
+    # 64-bit digest of the bit-packed rows, for spotting repeated states
+    return int.from_bytes(hashlib.blake2b(pack_grid(grid).tobytes(), digest_size=8).digest(), 'little')
+
+
+def _splitmix64(x):
+    x = x + 0x9E3779B97F4A7C15
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EB
+    return x ^ (x >> 31)
+
+
+class CellRNG:
+    # Counter-based tie breaking: the draw for a cell only depends on (seed,
+    # generation, flat cell index), not on how many draws were made before.
+    # Updating a subset of the lattice therefore gives the same picks as a
+    # full update. Set `generation` before each update. `offset` is added to
+    # every index, for callers that hand over a block of rows starting
+    # `offset` cells into the lattice.
+    def __init__(self, seed):
+        self.seed = int(seed) & _MASK64
+        self.generation = 0
+        self.offset = 0
+
+    def randint(self, high, index=None):
+        high = np.asarray(high)
+        if index is None:
+            index = np.arange(high.size).reshape(high.shape)
+        counter = self.seed ^ ((self.generation * 0xD1B54A32D192ED03) & _MASK64)
+        key = _splitmix64(np.array([counter], dtype=np.uint64))
+        index = np.asarray(index, dtype=np.int64) + self.offset
+        h = _splitmix64(index.astype(np.uint64) ^ key)
+        # Multiply-shift maps the top 32 bits onto [0, high)
+        return (((h >> np.uint64(32)) * high.astype(np.uint64)) >> np.uint64(32)).astype(np.intp)
+
+
+def _draw_ties(counts, rng):
+    # One draw in [0, counts) per cell, in row-major blocks so that the
+    # sequential stream matches a single call without its int64 temporaries
+    pick = np.empty(counts.shape, dtype=counts.dtype)
+    n, m = counts.shape
+    for start in range(0, n, TIE_BLOCK_ROWS):
+        block = counts[start:start + TIE_BLOCK_ROWS]
+        if isinstance(rng, CellRNG):
+            index = np.arange(start * m, start * m + block.size).reshape(block.shape)
+            pick[start:start + TIE_BLOCK_ROWS] = rng.randint(block, index=index)
+        else:
+            pick[start:start + TIE_BLOCK_ROWS] = rng.randint(block)
+    return pick
+
+
+def imitate_best(grid, scores, boundary, rng=np.random, return_mixed=False, neighborhood='Moore'):
+    # Every cell adopts the strategy of the best scoring cell in its
+    # neighborhood (itself included). Ties are broken uniformly with one
+    # rng.randint call per cell in row-major order, which for the Moore
+    # neighborhood consumes the random stream exactly like the original nested
+    # loop did. For a stack of replicas `rng` is a sequence holding one
+    # generator per replica.
+    # With return_mixed, also flag the cells whose tied best neighbors hold
+    # both strategies, i.e. whose outcome depends on the tie break.
+    # `scores` are either float payoffs or the ranks from score_ranks.
+    nb = get_neighborhood(neighborhood)
+    n, m = grid.shape[-2:]
+    r = nb.radius
+    low = -np.inf if scores.dtype.kind == 'f' else 0
+    padded_scores = _pad(scores, boundary, fill_value=low, width=r)
+    padded_grid = _pad(grid, boundary, width=r)
+    views = [(padded_scores[..., r + di:r + di + n, r + dj:r + dj + m],
+              padded_grid[..., r + di:r + di + n, r + dj:r + dj + m])
+             for di, dj in nb.offsets]
+
+    best = np.full(grid.shape, low, dtype=scores.dtype)
+    for s, _ in views:
+        np.maximum(best, s, out=best)
+    counts = np.zeros(grid.shape, dtype=nb.tie_dtype)
+    for s, _ in views:
+        counts += s == best
+
+    if grid.ndim == 2:
+        pick = _draw_ties(counts, rng)
+    else:
+        pick = np.stack([_draw_ties(c, r) for r, c in zip(rng, counts)])
+
+    # Walk the offsets in the loop's order and take the pick-th best neighbor
+    new_grid = np.empty_like(grid)
+    seen = np.zeros(grid.shape, dtype=nb.tie_dtype)
+    if return_mixed:
+        # Cooperators among the tied best neighbors
+        best_c = np.zeros(grid.shape, dtype=nb.tie_dtype)
+    for s, g in views:
+        hit = s == best
+        np.copyto(new_grid, g, where=hit & (seen == pick))
+        seen += hit
+        if return_mixed:
+            best_c += hit & g.view(bool)
+    if return_mixed:
+        return new_grid, (best_c > 0) & (best_c < seen)
+    return new_grid
+
+
+def _neighbor_indices(idx, shape, offsets, boundary):
+    # Flat indices of the cells at `offsets` around each flat index in `idx`,
+    # shape (len(offsets), len(idx)), and a mask of those inside the lattice
+    n, m = shape
+    i, j = np.divmod(np.asarray(idx), m)
+    ii = i + np.array([di for di, _ in offsets])[:, None]
+    jj = j + np.array([dj for _, dj in offsets])[:, None]
+    if boundary == 'periodic':
+        return (ii % n) * m + (jj % m), np.ones(ii.shape, dtype=bool)
+    valid = (ii >= 0) & (ii < n) & (jj >= 0) & (jj < m)
+    return np.where(valid, ii * m + jj, 0), valid
+
+
+def frontier(changed, shape, boundary, neighborhood='Moore'):
+    # Mask of the cells within two neighborhood steps of one of the `changed`
+    # flat indices, the only cells whose next strategy can have changed
+    offsets = get_neighborhood(neighborhood).frontier_offsets
+    mask = np.zeros(shape[0] * shape[1], dtype=bool)
+    if len(changed) * len(offsets) > mask.size:
+        # With this many changes the per-change index arrays would outgrow
+        # the lattice, dilating a mask of the changes is cheaper
+        mask[changed] = True
+        return _dilate(mask.reshape(shape), offsets, boundary)
+    nbrs, valid = _neighbor_indices(changed, shape, offsets, boundary)
+    mask[nbrs[valid]] = True
+    return mask.reshape(shape)
+
+
+def _dilate(mask, offsets, boundary):
+    # Cells at one of `offsets` from a cell set in `mask`
+    n, m = mask.shape
+    r = max(max(abs(di), abs(dj)) for di, dj in offsets)
+    padded = _pad(mask, boundary, width=r)
+    out = np.zeros_like(mask)
+    for di, dj in offsets:
+        out |= padded[r - di:r - di + n, r - dj:r - dj + m]
+    return out
+
+
+def imitate_best_at(grid, b, neighborhood, boundary, idx, rng):
+    # Same rule as imitate_best, evaluated only at the flat indices `idx`.
+    # Returns the new strategies there and the mixed-tie flags. `rng` must
+    # accept an `index` argument (CellRNG) for the picks to match a full update.
+    #
+    # The grid is padded by two radii so that every neighbor of a cell, and
+    # every neighbor of those, is a fixed offset away in the flat array.
+    nb = get_neighborhood(neighborhood)
+    n, m = grid.shape
+    pad = 2 * nb.radius
+    width = m + 2 * pad
+    padded = np.pad(grid, pad, mode='wrap' if boundary == 'periodic' else 'constant').reshape(-1)
+    i, j = np.divmod(np.asarray(idx), m)
+    pos = (i + pad) * width + j + pad
+    flat_offsets = np.array([di * width + dj for di, dj in nb.offsets])
+    nbrs = pos + flat_offsets[:, None]
+
+    # Score every distinct cell the active cells look at. A dense scratch
+    # array is cheaper than sorting the indices to deduplicate them.
+    needed = np.zeros(padded.size, dtype=bool)
+    needed[nbrs] = True
+    cells = np.flatnonzero(needed)
+    c_scores = np.zeros(len(cells), dtype=np.int32)
+    for offset in flat_offsets:
+        c_scores += padded[cells + offset]
+    cell_scores = np.empty(padded.size)
+    cell_scores[cells] = np.where(padded[cells] == 1, c_scores, b * c_scores)
+    if boundary != 'periodic':
+        ci, cj = np.divmod(cells, width)
+        outside = (ci < pad) | (ci >= n + pad) | (cj < pad) | (cj >= m + pad)
+        cell_scores[cells[outside]] = -np.inf
+    nbr_scores = cell_scores[nbrs]
+
+    hit = nbr_scores == nbr_scores.max(axis=0)
+    pick = rng.randint(hit.sum(axis=0), index=idx)
+    rank = np.cumsum(hit, axis=0) - 1
+    choice = np.argmax(hit & (rank == pick), axis=0)
+
+    strats = padded[nbrs]
+    values = strats[choice, np.arange(len(idx))]
+    mixed = (hit & (strats == 1)).any(axis=0) & (hit & (strats == 0)).any(axis=0)
+    return values, mixed
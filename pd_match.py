@@ -0,0 +1,110 @@
+import numpy as np
+
+# A memory-one strategy is the vector (p_CC, p_CD, p_DC, p_DD, p_first): the
+# probability of cooperating after each outcome of the previous round (own
+# move first) and in the first round.
+CC, CD, DC, DD, FIRST = range(5)
+
+
+def payoff_tables(payoff_matrix, cooperate, defect):
+    # 2x2 tables indexed by [own move, opponent move], 1 = cooperate
+    moves = (defect, cooperate)
+    pay1 = np.array([[payoff_matrix[(a, b)][0] for b in moves] for a in moves])
+    pay2 = np.array([[payoff_matrix[(a, b)][1] for b in moves] for a in moves])
+    return pay1, pay2
+
+
+def _cooperates(p, mine, theirs, rng):
+    # Previous outcome as an index into the vector: CC=0, CD=1, DC=2, DD=3
+    state = 2 * (1 - mine) + (1 - theirs)
+    prob = np.take_along_axis(p, state, axis=1)
+    return (rng.random(state.shape) < prob).astype(np.int8)
+
+
+def play_memory_one(p1, p2, pay1, pay2, rounds=100, repetitions=1, rng=None):
+    # Plays k pairings at once, p1[q] against p2[q], each `repetitions` times.
+    # Returns the total scores of both sides, shape (k, repetitions).
+    rng = np.random.default_rng() if rng is None else rng
+    p1 = np.atleast_2d(np.asarray(p1, dtype=float))
+    p2 = np.atleast_2d(np.asarray(p2, dtype=float))
+    shape = (len(p1), repetitions)
+
+    m1 = (rng.random(shape) < p1[:, FIRST:FIRST + 1]).astype(np.int8)
+    m2 = (rng.random(shape) < p2[:, FIRST:FIRST + 1]).astype(np.int8)
+    score1 = np.zeros(shape, dtype=pay1.dtype)
+    score2 = np.zeros(shape, dtype=pay2.dtype)
+    for _ in range(rounds):
+        score1 += pay1[m1, m2]
+        score2 += pay2[m1, m2]
+        m1, m2 = _cooperates(p1, m1, m2, rng), _cooperates(p2, m2, m1, rng)
+    return score1, score2
+
+
+# Exact expected payoffs. For two memory-one strategies the outcome of a
+# round is a Markov chain over CC, CD, DC, DD (player 1's move first), so the
+# expected score follows from its transition matrix without playing a round.
+
+# Index of the same outcome seen from the other side, CD <-> DC
+_SWAP = np.array([CC, DC, CD, DD])
+
+
+def transition_matrices(p1, p2):
+    # (k, 4, 4) matrices, row = previous outcome, column = next outcome
+    p1 = np.atleast_2d(np.asarray(p1, dtype=float))
+    p2 = np.atleast_2d(np.asarray(p2, dtype=float))
+    c1 = p1[:, :FIRST]
+    c2 = p2[:, :FIRST][:, _SWAP]
+    return np.stack([c1 * c2, c1 * (1 - c2), (1 - c1) * c2, (1 - c1) * (1 - c2)], axis=-1)
+
+
+def initial_distributions(p1, p2):
+    p1 = np.atleast_2d(np.asarray(p1, dtype=float))
+    p2 = np.atleast_2d(np.asarray(p2, dtype=float))
+    c1, c2 = p1[:, FIRST], p2[:, FIRST]
+    return np.stack([c1 * c2, c1 * (1 - c2), (1 - c1) * c2, (1 - c1) * (1 - c2)], axis=-1)
+
+
+def outcome_payoffs(pay):
+    # Payoff table as a vector over CC, CD, DC, DD
+    return np.array([pay[1, 1], pay[1, 0], pay[0, 1], pay[0, 0]], dtype=float)
+
+
+def _power_sum(m, rounds):
+    # sum_{t < rounds} m^t by binary doubling, log2(rounds) matrix products
+    eye = np.broadcast_to(np.eye(4), m.shape)
+    total, power = np.zeros(m.shape), eye
+    block_sum, block_power = eye, m
+    while rounds:
+        if rounds & 1:
+            total = total + power @ block_sum
+            power = power @ block_power
+        block_sum = block_sum + block_power @ block_sum
+        block_power = block_power @ block_power
+        rounds >>= 1
+    return total
+
+
+def expected_payoffs(p1, p2, pay1, pay2, rounds=100, discount=1.0):
+    # Expected total scores of k pairings, each round weighted by
+    # discount ** t. With rounds=None the match never ends and the discounted
+    # sum is solved in closed form, which needs discount < 1.
+    m = transition_matrices(p1, p2)
+    v = initial_distributions(p1, p2)
+    if rounds is None:
+        if not discount < 1:
+            raise ValueError("an infinite horizon needs discount < 1")
+        # sum_t discount^t v M^t = v (I - discount M)^-1
+        a = np.eye(4) - discount * m
+        occupancy = np.linalg.solve(np.swapaxes(a, 1, 2), v[..., None])[..., 0]
+    else:
+        occupancy = (v[:, None, :] @ _power_sum(discount * m, rounds))[:, 0]
+    return occupancy @ outcome_payoffs(pay1), occupancy @ outcome_payoffs(pay2)
+
+
+def expected_payoff_matrix(vectors, pay1, pay2, rounds=100, discount=1.0):
+    # A[i, j] is the expected score of strategy i against strategy j
+    vectors = np.asarray(vectors, dtype=float)
+    k = len(vectors)
+    i, j = np.divmod(np.arange(k * k), k)
+    score1, _ = expected_payoffs(vectors[i], vectors[j], pay1, pay2, rounds, discount)
+    return score1.reshape(k, k)
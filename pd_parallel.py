@@ -0,0 +1,190 @@
+import multiprocessing as mp
+import os
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from pd_engine import PDEngine
+from pd_lattice import CellRNG, imitate_best, neighbor_count, score_ranks
+from pd_neighborhood import get_neighborhood
+
+# Layout of the shared control block, written by the parent before each
+# generation: generation, b, which buffer holds the current grid, the rule
+# (RULE_CODES), the tft threshold (NaN for None) and a stop flag.
+RULE_CODES = {'imitate_best': 0, 'tft': 1}
+_GENERATION, _B, _CURRENT, _RULE, _THRESHOLD, _STOP = range(6)
+
+
+def strip_bounds(n, strips):
+    # Row ranges [start, stop) of `strips` contiguous strips, as even as possible
+    edges = np.linspace(0, n, strips + 1).astype(int)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def strip_update(grid, start, stop, b, neighborhood, boundary, rule='imitate_best',
+                 threshold=None, tie_rng=None):
+    # Next strategies of rows [start, stop) of `grid`, reading only those rows
+    # and a halo of two neighborhood radii above and below (one for tft). At
+    # the top and bottom of the lattice the halo wraps around for 'periodic'
+    # and lies outside the lattice for 'fixed'. Ties are drawn from a
+    # CellRNG at the cells' lattice indices, so stitching the strips back
+    # together gives exactly the single-process update.
+    nb = get_neighborhood(neighborhood)
+    n, m = grid.shape
+    halo = nb.radius if rule == 'tft' else 2 * nb.radius
+    rows = np.arange(start - halo, stop + halo)
+    if boundary == 'periodic':
+        ext = grid[rows % n]
+        inside = np.ones(len(rows), dtype=bool)
+    else:
+        inside = (rows >= 0) & (rows < n)
+        ext = np.zeros((len(rows), m), dtype=grid.dtype)
+        ext[inside] = grid[rows[inside]]
+
+    if rule == 'tft':
+        coop = neighbor_count(ext, nb, boundary)
+        size = neighbor_count(np.repeat(inside[:, None], m, axis=1).astype(np.uint8), nb, boundary)
+        defect = (size - coop)[halo:-halo].astype(np.intp)
+        size = size[halo:-halo]
+        if threshold is None:
+            return (2 * defect <= size).astype(np.uint8)
+        return (defect < threshold).astype(np.uint8)
+
+    scores = score_ranks(ext, b, nb, boundary)
+    # Rows beyond a fixed edge never win, like the lattice's padding
+    scores[~inside] = 0
+    # Scores are right from one radius in, which is all the strip's rows look at
+    r = nb.radius
+    tie_rng.offset = (start - r) * m
+    new = imitate_best(ext[r:-r], scores[r:-r], boundary, tie_rng, neighborhood=nb)
+    return new[r:-r]
+
+
+def _strip_worker(names, shape, control, coop, index, start, stop, neighborhood, boundary,
+                  seed, go, done):
+    shms = [SharedMemory(name=name) for name in names]
+    buffers = [np.ndarray(shape, dtype=np.uint8, buffer=shm.buf) for shm in shms]
+    tie_rng = CellRNG(seed)
+    rules = {code: rule for rule, code in RULE_CODES.items()}
+    try:
+        while True:
+            go.wait()
+            if control[_STOP]:
+                break
+            current = int(control[_CURRENT])
+            tie_rng.generation = int(control[_GENERATION])
+            threshold = None if np.isnan(control[_THRESHOLD]) else control[_THRESHOLD]
+            new = strip_update(buffers[current], start, stop, control[_B], neighborhood, boundary,
+                               rules[int(control[_RULE])], threshold, tie_rng)
+            buffers[1 - current][start:stop] = new
+            coop[index] = np.count_nonzero(new)
+            done.wait()
+    except BaseException:
+        # Wake the parent instead of leaving it waiting on a barrier forever
+        go.abort()
+        done.abort()
+        raise
+    finally:
+        del buffers
+        for shm in shms:
+            shm.close()
+
+
+class StripEngine(PDEngine):
+    # PDEngine with each generation computed by `workers` processes, one per
+    # row strip. The grid lives in two shared memory buffers, the current
+    # generation and the next one; every worker reads its strip plus a halo of
+    # neighboring rows from the current buffer, writes its rows of the next
+    # one, and a barrier ends the generation. Ties use the hashed CellRNG
+    # scheme, so the run is identical to PDEngine(..., tie_break='hashed')
+    # with the same seed, whatever the number of workers.
+    #
+    # The neighborhood and boundary are fixed when the workers start. `grid`
+    # and `prev_grid` are views of the shared buffers; copy them to keep a
+    # generation around. Call close(), or use the engine as a context
+    # manager, to stop the workers and free the shared memory.
+    def __init__(self, n=100, b=1.8, neighborhood='Moore', boundary='periodic',
+                 initial_config='random', strategy_mode='imitate_best', seed=None,
+                 stats_every=1, tft_threshold=None, workers=None):
+        workers = min(workers or os.cpu_count() or 1, n)
+        self._shms = [SharedMemory(create=True, size=n * n) for _ in range(2)]
+        self._buffers = [np.ndarray((n, n), dtype=np.uint8, buffer=shm.buf) for shm in self._shms]
+        self._current = 0
+        self._workers = []
+        super().__init__(n=n, b=b, neighborhood=neighborhood, boundary=boundary,
+                         initial_config=initial_config, strategy_mode=strategy_mode, seed=seed,
+                         tie_break='hashed', stats_every=stats_every, tft_threshold=tft_threshold)
+
+        ctx = mp.get_context()
+        self._control = ctx.Array('d', 6, lock=False)
+        self._coop = ctx.Array('q', workers, lock=False)
+        # The parent takes part in both barriers
+        self._go = ctx.Barrier(workers + 1)
+        self._done = ctx.Barrier(workers + 1)
+        names = [shm.name for shm in self._shms]
+        for index, (start, stop) in enumerate(strip_bounds(n, workers)):
+            proc = ctx.Process(target=_strip_worker, daemon=True,
+                               args=(names, (n, n), self._control, self._coop, index, start, stop,
+                                     neighborhood, boundary, self.tie_rng.seed, self._go,
+                                     self._done))
+            proc.start()
+            self._workers.append(proc)
+
+    @property
+    def grid(self):
+        return self._buffers[self._current]
+
+    @grid.setter
+    def grid(self, value):
+        np.copyto(self._buffers[self._current], value)
+
+    def update_grid(self):
+        rule = self.rule
+        if rule in ('pure_c', 'pure_d'):
+            self._buffers[1 - self._current][:] = 1 if rule == 'pure_c' else 0
+        else:
+            control = self._control
+            control[_GENERATION] = self.generation
+            control[_B] = self.b
+            control[_CURRENT] = self._current
+            control[_RULE] = RULE_CODES[rule]
+            control[_THRESHOLD] = np.nan if self.tft_threshold is None else self.tft_threshold
+            self._go.wait()
+            self._done.wait()
+        self.prev_grid = self._buffers[self._current]
+        self._current = 1 - self._current
+
+    def step(self):
+        rule = self.rule
+        self.update_grid()
+        self.generation += 1
+        if rule in ('pure_c', 'pure_d'):
+            self.ts_data.append(1.0 if rule == 'pure_c' else 0.0)
+        else:
+            # The workers count their strip's cooperators, no pass over the grid
+            self.ts_data.append(sum(self._coop) / self.grid.size)
+
+    def close(self):
+        if not self._workers:
+            return
+        if self._go.broken:
+            for proc in self._workers:
+                proc.terminate()
+        else:
+            self._control[_STOP] = 1
+            self._go.wait()
+        for proc in self._workers:
+            proc.join()
+        self._workers = []
+        # Keep the last two generations readable once the memory is gone
+        self._buffers = [buf.copy() for buf in self._buffers]
+        self.prev_grid = self._buffers[1 - self._current] if self.prev_grid is not None else None
+        for shm in self._shms:
+            shm.close()
+            shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
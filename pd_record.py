@@ -0,0 +1,196 @@
+import json
+import os
+
+import numpy as np
+
+from pd_clusters import cluster_stats
+from pd_engine import METRIC_FIELDS
+from pd_lattice import pack_grid, unpack_grid
+from pd_neighborhood import Neighborhood
+
+# A recording is a directory holding
+#
+#   header.json   n, b, boundary, neighborhood, seed, ... of the run
+#   grids.bin     one bit-packed grid per generation, n * ceil(n / 8) bytes each
+#   <field>.f8    one float64 per generation for each metric column, NaN where
+#                 the engine did not report it (e.g. cluster stats between
+#                 stats_every generations), plus a 'b' column
+#
+# Files are only appended to (or cut back when a resumed run continues a
+# recording), so the number of generations follows from the file sizes and
+# a recording cut short by a crash stays readable.
+HEADER = 'header.json'
+GRIDS = 'grids.bin'
+
+
+def _column_path(path, field):
+    return os.path.join(path, f'{field}.f8')
+
+
+class TrajectoryRecorder:
+    # Appends the engine's grid and metrics to the recording at `path` every
+    # time record() is called, e.g. as the callback of engine.run. With
+    # append=True an existing recording of the same lattice is continued
+    # from the engine's generation: rows recorded past it, e.g. by a run
+    # that crashed after its last checkpoint, are dropped so that row g
+    # stays generation g.
+    def __init__(self, path, engine, with_stats=True, append=False):
+        self.path = path
+        self.with_stats = with_stats
+        self.fields = (METRIC_FIELDS if with_stats else METRIC_FIELDS[:2]) + ('b',)
+        self._frame_bytes = engine.n * ((engine.n + 7) // 8)
+        neighborhood = engine.neighborhood
+        if isinstance(neighborhood, Neighborhood):
+            neighborhood = [list(o) for o in neighborhood.offsets]
+        header = {
+            'n': engine.n,
+            'row_bytes': (engine.n + 7) // 8,
+            'b': engine.b,
+            'boundary': engine.boundary,
+            'neighborhood': neighborhood,
+            'seed': getattr(engine, 'seed', None),
+            'initial_config': engine.initial_config,
+            'strategy_mode': engine.strategy_mode,
+            'fields': list(self.fields),
+        }
+        if append and os.path.exists(os.path.join(path, HEADER)):
+            with open(os.path.join(path, HEADER)) as f:
+                existing = json.load(f)
+            if existing['n'] != header['n'] or existing['fields'] != header['fields']:
+                raise ValueError(f"{path} holds a different lattice or metric columns")
+            self._truncate(engine.generation + 1)
+        else:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, HEADER), 'w') as f:
+                json.dump(header, f, indent=1)
+            for name in (GRIDS,) + tuple(f'{field}.f8' for field in self.fields):
+                open(os.path.join(path, name), 'wb').close()
+        self._grids = open(os.path.join(path, GRIDS), 'ab')
+        self._columns = {field: open(_column_path(path, field), 'ab') for field in self.fields}
+
+    def _truncate(self, rows):
+        files = [(os.path.join(self.path, GRIDS), self._frame_bytes)]
+        files += [(_column_path(self.path, field), 8) for field in self.fields]
+        for name, row_bytes in files:
+            if os.path.getsize(name) < rows * row_bytes:
+                raise ValueError(f"{name} ends before generation {rows - 1}, cannot continue it")
+            os.truncate(name, rows * row_bytes)
+
+    def record(self, engine):
+        self._grids.write(pack_grid(engine.grid).tobytes())
+        row = engine.metrics(self.with_stats)
+        row['b'] = engine.b
+        for field, f in self._columns.items():
+            f.write(np.float64(row.get(field, np.nan)).tobytes())
+
+    def flush(self):
+        for f in (self._grids, *self._columns.values()):
+            f.flush()
+
+    def close(self):
+        for f in (self._grids, *self._columns.values()):
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Trajectory:
+    # Read side of a recording. Grids and metric columns are memory-mapped,
+    # so seeking to a generation costs one row-packed frame read and slices
+    # of `frames` or of a column are views into the files, not copies.
+    # refresh() picks up generations appended since the recording was opened.
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, HEADER)) as f:
+            self.header = json.load(f)
+        self.n = self.header['n']
+        self.refresh()
+
+    def refresh(self):
+        frame_bytes = self.n * self.header['row_bytes']
+        counts = [os.path.getsize(os.path.join(self.path, GRIDS)) // frame_bytes]
+        counts += [os.path.getsize(_column_path(self.path, field)) // 8
+                   for field in self.header['fields']]
+        # A write interrupted between files leaves some of them a row ahead
+        self.length = min(counts)
+        self.frames = self._map(GRIDS, np.uint8, (self.n, self.header['row_bytes']))
+        self.columns = {field: self._map(f'{field}.f8', np.float64, ())
+                        for field in self.header['fields']}
+
+    def _map(self, name, dtype, row_shape):
+        shape = (self.length,) + row_shape
+        if self.length == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return self.length
+
+    def grid(self, generation):
+        return unpack_grid(self.frames[generation], self.n)
+
+    def __getitem__(self, generation):
+        if isinstance(generation, slice):
+            return unpack_grid(self.frames[generation], self.n)
+        return self.grid(generation)
+
+    def column(self, field):
+        return self.columns[field]
+
+
+class ReplayEngine:
+    # Plays a recording back through the engine interface the GUIs and
+    # EngineWorker use, without simulating anything. step() moves one
+    # generation forward and seek() jumps anywhere. Parameters set on it
+    # (b, boundary, ...) have no effect on what is shown.
+    def __init__(self, trajectory):
+        self.trajectory = trajectory
+        header = trajectory.header
+        self.n = header['n']
+        self.b = header['b']
+        self.boundary = header['boundary']
+        self.neighborhood = header['neighborhood']
+        if isinstance(self.neighborhood, list):
+            self.neighborhood = Neighborhood(self.neighborhood)
+        self.initial_config = header['initial_config']
+        self.strategy_mode = header['strategy_mode']
+        self.seek(0)
+
+    def seek(self, generation):
+        self.generation = max(0, min(generation, len(self.trajectory) - 1))
+        self.grid = self.trajectory.grid(self.generation)
+        self.prev_grid = self.trajectory.grid(self.generation - 1) if self.generation > 0 else None
+        self.b = float(self.trajectory.column('b')[self.generation])
+
+    @property
+    def ts_data(self):
+        return self.trajectory.column('coop_frac')[:self.generation + 1]
+
+    def reset(self):
+        self.seek(0)
+
+    def step(self):
+        if self.generation + 1 < len(self.trajectory):
+            self.seek(self.generation + 1)
+
+    def run(self, generations, callback=None):
+        for _ in range(generations):
+            self.step()
+            if callback is not None:
+                callback(self)
+
+    def latest_cluster_stats(self):
+        # Recorded stats where there are any, computed from the grid otherwise
+        columns = self.trajectory.columns
+        if 'avg_c_size' in columns and not np.isnan(columns['avg_c_size'][self.generation]):
+            return {'avg_c_size': float(columns['avg_c_size'][self.generation]),
+                    'max_c_size': int(columns['max_c_size'][self.generation]),
+                    'n_clusters': int(columns['n_clusters'][self.generation])}
+        return cluster_stats(self.grid, neighborhood=self.neighborhood)
+
+    get_cluster_stats = latest_cluster_stats
+
@@ -0,0 +1,95 @@
+import numpy as np
+
+# Display codes: D, C, D←C, C←D
+DEFECTOR, COOPERATOR, NEW_DEFECTOR, NEW_COOPERATOR = 0, 1, 2, 3
+
+
+def transition_codes(grid, prev_grid=None):
+    # Color codes for the grid view, with the cells that switched strategy
+    # since prev_grid marked separately
+    if prev_grid is None:
+        return grid
+    return np.where((grid == 0) & (prev_grid == 1), NEW_DEFECTOR,
+                    np.where((grid == 1) & (prev_grid == 0), NEW_COOPERATOR, grid)).astype(np.uint8)
+
+
+def downsample(a, max_side):
+    # Keep every k-th cell so that neither side exceeds max_side; there is
+    # no point uploading more cells than the axes has pixels
+    step = max(1, -(-max(a.shape) // max(1, max_side)))
+    return a[::step, ::step]
+
+
+class GridRenderer:
+    # Draws the lattice, the optional stats text and the time series line as
+    # animated artists. A frame restores the cached background and redraws
+    # only those artists, a full canvas.draw() is only needed when the axes
+    # themselves change (first frame, resize, time axis growing or
+    # shrinking, new image shape).
+    def __init__(self, canvas, grid_ax, ts_ax, ts_line, cmap, stats_text=True):
+        self.canvas = canvas
+        self.grid_ax = grid_ax
+        self.ts_ax = ts_ax
+        self.ts_line = ts_line
+        self.image = grid_ax.imshow(np.zeros((1, 1), dtype=np.uint8), cmap=cmap, vmin=0, vmax=3,
+                                    interpolation='nearest', animated=True)
+        self.text = None
+        if stats_text:
+            self.text = grid_ax.text(0.05, 0.95, '', transform=grid_ax.transAxes, animated=True,
+                                     verticalalignment='top', bbox=dict(facecolor='white', alpha=0.8))
+        self.ts_line.set_animated(True)
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def artists(self):
+        return [a for a in (self.image, self.text, self.ts_line) if a is not None]
+
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for artist in self.artists():
+            artist.axes.draw_artist(artist)
+
+    def max_side(self):
+        extent = self.grid_ax.get_window_extent()
+        return int(max(extent.width, extent.height))
+
+    def render(self, grid, prev_grid=None, ts_data=(), text=None):
+        # Downsample before computing the transitions, it is cheaper
+        max_side = self.max_side()
+        grid = downsample(grid, max_side)
+        if prev_grid is not None:
+            prev_grid = downsample(prev_grid, max_side)
+        data = transition_codes(grid, prev_grid)
+
+        full_redraw = self.background is None
+        if data.shape != self.image.get_array().shape:
+            h, w = data.shape
+            self.image.set_extent((-0.5, w - 0.5, h - 0.5, -0.5))
+            self.grid_ax.set_xlim(-0.5, w - 0.5)
+            self.grid_ax.set_ylim(h - 0.5, -0.5)
+            full_redraw = True
+        self.image.set_data(data)
+
+        if self.text is not None and text is not None:
+            self.text.set_text(text)
+
+        # Grow the time axis geometrically so it rarely forces a full redraw,
+        # and shrink it when the series got much shorter (reset, new
+        # parameters, scrubbing back in a replay)
+        self.ts_line.set_data(np.arange(len(ts_data)), ts_data)
+        limit = max(50, 2 * len(ts_data))
+        xmax = self.ts_ax.get_xlim()[1]
+        if len(ts_data) + 1 > xmax or (len(ts_data) < xmax / 4 and limit < xmax):
+            self.ts_ax.set_xlim(0, limit)
+            full_redraw = True
+
+        if full_redraw:
+            # draw_event caches the new background and draws the artists
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self._draw_artists()
+            self.canvas.blit(self.canvas.figure.bbox)
@@ -0,0 +1,312 @@
+import argparse
+import sys
+
+import numpy as np
+
+from pd_engine import MetricsWriter
+from pd_lattice import imitate_best
+from pd_neighborhood import get_neighborhood
+
+# The strategies of titfortat.py, in the order of titfortat.players. A cell
+# holds the index of its strategy in this tuple. test_pd_strategy_lattice.py
+# checks this copy, PAYOFFS and the rules below against titfortat.py.
+STRATEGIES = ('always_cooperate', 'always_defect', 'random_choice_defect', 'tit_for_tat',
+              'tit_for_two_tats', 'random_choice_cooperate', 'tat_for_tit', 'random_choice_neutral',
+              'bully', 'original_gradual', 'contrite_tit_for_tat', 'spiteful_tit_for_tat')
+
+# Payoffs of titfortat.payoff_matrix as [own move, opponent move], 1 = cooperate
+PAYOFFS = np.array([[1, 5], [0, 3]], dtype=np.int32)
+
+# Bits of EdgeGames.flags
+RETALIATING = 1   # spiteful_tit_for_tat
+CALMING = 2       # original_gradual
+PUNISHING = 4     # original_gradual
+CONTRITE = 8      # contrite_tit_for_tat
+RECORDED = 16     # contrite_tit_for_tat has recorded its own move ...
+RECORDED_C = 32   # ... and it was a cooperation
+
+_COUNT_MAX = np.iinfo(np.uint16).max
+
+
+# Vectorized rules. Each gets the indices of the edge sides that play the
+# strategy, their own and opponent move history bytes (bit 0 = last round,
+# 1 = cooperate) and how many rounds they played, and returns their moves.
+# Stateful rules read and write their fields of `games` at `idx`.
+
+def _constant(move):
+    def rule(games, idx, own, opp, played, rng):
+        return np.full(len(idx), move, dtype=np.uint8)
+    return rule
+
+
+def _random(p):
+    def rule(games, idx, own, opp, played, rng):
+        return (rng.random_sample(len(idx)) < p).astype(np.uint8)
+    return rule
+
+
+def _tit_for_tat(first):
+    def rule(games, idx, own, opp, played, rng):
+        return np.where(played == 0, first, opp & 1).astype(np.uint8)
+    return rule
+
+
+def _bully(games, idx, own, opp, played, rng):
+    return np.where(played == 0, 0, 1 - (opp & 1)).astype(np.uint8)
+
+
+def _tit_for_two_tats(games, idx, own, opp, played, rng):
+    return ((played < 2) | ((opp & 3) != 0)).astype(np.uint8)
+
+
+def _spiteful(games, idx, own, opp, played, rng):
+    flags = games.flags[idx]
+    flags[(played > 1) & ((opp & 3) == 0)] |= RETALIATING
+    games.flags[idx] = flags
+    move = np.where(flags & RETALIATING, 0, opp & 1)
+    return np.where(played == 0, 1, move).astype(np.uint8)
+
+
+def _original_gradual(games, idx, own, opp, played, rng):
+    flags = games.flags[idx]
+    count = games.count[idx]
+    limit = games.limit[idx]
+    move = np.ones(len(idx), dtype=np.uint8)
+    playing = played > 0
+
+    calming = playing & ((flags & CALMING) != 0)
+    flags[calming] &= ~np.uint8(CALMING)
+
+    punishing = playing & ~calming & ((flags & PUNISHING) != 0)
+    more = punishing & (count < limit)
+    count[more] += 1
+    move[more] = 0
+    done = punishing & ~more
+    flags[done] = (flags[done] | CALMING) & ~np.uint8(PUNISHING)
+    count[done] = 0
+
+    provoked = playing & ~calming & ~punishing & ((opp & 1) == 0)
+    flags[provoked] |= PUNISHING
+    count[provoked] = np.minimum(count[provoked], _COUNT_MAX - 1) + 1
+    limit[provoked] = np.minimum(limit[provoked], _COUNT_MAX - 1) + 1
+    move[provoked] = 0
+
+    games.flags[idx] = flags
+    games.count[idx] = count
+    games.limit[idx] = limit
+    return move
+
+
+def _contrite(games, idx, own, opp, played, rng):
+    flags = games.flags[idx]
+    own_last = own & 1
+    opp_last = opp & 1
+    playing = played > 0
+
+    # If contrite but managed to cooperate: apologise
+    apologise = playing & ((flags & CONTRITE) != 0) & (own_last == 1)
+    flags[apologise] &= ~np.uint8(CONTRITE)
+
+    rest = playing & ~apologise
+    recorded = np.where(flags & RECORDED_C, 1, 0)
+    provoked = rest & ((flags & RECORDED) != 0) & (recorded != own_last) & (own_last == 0) & (opp_last == 1)
+    flags[provoked] |= CONTRITE
+    flags[rest] = (flags[rest] & ~np.uint8(RECORDED_C)) | RECORDED | (own_last[rest] * np.uint8(RECORDED_C))
+
+    games.flags[idx] = flags
+    return np.where(rest, opp_last, 1).astype(np.uint8)
+
+
+RULES = {
+    'always_cooperate': _constant(1),
+    'always_defect': _constant(0),
+    'random_choice_defect': _random(0.25),
+    'tit_for_tat': _tit_for_tat(1),
+    'tit_for_two_tats': _tit_for_two_tats,
+    'random_choice_cooperate': _random(0.75),
+    'tat_for_tit': _tit_for_tat(0),
+    'random_choice_neutral': _random(0.5),
+    'bully': _bully,
+    'original_gradual': _original_gradual,
+    'contrite_tit_for_tat': _contrite,
+    'spiteful_tit_for_tat': _spiteful,
+}
+
+
+class EdgeGames:
+    # Iterated games on `size` edges at once. Every field has shape
+    # (2 * size,): entries [0, size) are the first side of each edge and
+    # [size, 2 * size) the second side. Memory is a few bytes per side:
+    #   hist    the last 8 own moves as bits, bit 0 the latest
+    #   played  rounds played so far, saturating at 255
+    #   flags   strategy state bits (RETALIATING, CALMING, ...)
+    #   count, limit   original_gradual's punishment counters
+    def __init__(self, size):
+        self.size = size
+        self.hist = np.zeros(2 * size, dtype=np.uint8)
+        self.played = np.zeros(2 * size, dtype=np.uint8)
+        self.flags = np.zeros(2 * size, dtype=np.uint8)
+        self.count = np.zeros(2 * size, dtype=np.uint16)
+        self.limit = np.zeros(2 * size, dtype=np.uint16)
+
+    def reset(self, edges=None):
+        # Forget the games on the edges in the `edges` mask, or on all of them
+        if edges is None:
+            sides = slice(None)
+        else:
+            idx = np.flatnonzero(edges)
+            sides = np.concatenate([idx, idx + self.size])
+        for field in (self.hist, self.played, self.flags, self.count, self.limit):
+            field[sides] = 0
+
+    def groups(self, strategies, names=STRATEGIES):
+        # (rule, side indices, opponent side indices) for every strategy present
+        strategies = np.asarray(strategies).reshape(-1)
+        groups = []
+        for s, name in enumerate(names):
+            idx = np.flatnonzero(strategies == s)
+            if len(idx):
+                groups.append((RULES[name], idx, (idx + self.size) % (2 * self.size)))
+        return groups
+
+    def play(self, strategies, rounds=1, rng=np.random, payoffs=PAYOFFS, names=STRATEGIES):
+        # Plays `rounds` rounds on every edge. `strategies` has shape
+        # (2, size), the strategy index of each side. Returns the payoffs of
+        # both sides summed over the rounds, shape (2, size).
+        groups = self.groups(strategies, names)
+        total = np.zeros(2 * self.size, dtype=np.int32)
+        moves = np.empty(2 * self.size, dtype=np.uint8)
+        for _ in range(rounds):
+            for rule, idx, opp_idx in groups:
+                moves[idx] = rule(self, idx, self.hist[idx], self.hist[opp_idx], self.played[idx], rng)
+            first, second = moves[:self.size], moves[self.size:]
+            total[:self.size] += payoffs[first, second]
+            total[self.size:] += payoffs[second, first]
+            self.hist = (self.hist << 1) | moves
+            np.minimum(self.played, 254, out=self.played)
+            self.played += 1
+        return total.reshape(2, self.size)
+
+
+class StrategyLattice:
+    # n x n lattice where every cell holds one of STRATEGIES. Each generation
+    # every pair of neighbors plays `rounds` more rounds of their iterated
+    # game, picking up where the previous generation stopped, and every cell
+    # then imitates the best scoring cell of its neighborhood. A cell that
+    # switches strategy starts fresh games with all its neighbors.
+    def __init__(self, n=100, neighborhood='Moore', boundary='periodic', rounds=1,
+                 strategies=STRATEGIES, seed=None):
+        self.n = n
+        self.neighborhood = neighborhood
+        self.boundary = boundary
+        self.rounds = rounds
+        self.strategies = tuple(strategies)
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
+        # Each undirected edge is stored once, at the cell it starts from
+        self.offsets = get_neighborhood(neighborhood).forward_offsets
+        self.reset()
+
+    def reset(self, grid=None):
+        if grid is None:
+            grid = self.rng.randint(len(self.strategies), size=(self.n, self.n)).astype(np.uint8)
+        self.grid = grid
+        self.games = EdgeGames(len(self.offsets) * self.n * self.n)
+        self.generation = 0
+        self.ts_data = [self.shares()]
+
+    def shares(self):
+        return np.bincount(self.grid.ravel(), minlength=len(self.strategies)) / self.grid.size
+
+    def _shift(self, a, di, dj):
+        # out[i, j] = a[i + di, j + dj], with zeros beyond a fixed boundary
+        if self.boundary == 'periodic':
+            return np.roll(a, (-di, -dj), axis=(0, 1))
+        n = self.n
+        out = np.zeros_like(a)
+        out[max(0, -di):n - max(0, di), max(0, -dj):n - max(0, dj)] = \
+            a[max(0, di):n - max(0, -di), max(0, dj):n - max(0, -dj)]
+        return out
+
+    def edge_valid(self):
+        # (edges, n, n) mask of the edges inside the lattice
+        ones = np.ones((self.n, self.n), dtype=bool)
+        return np.stack([self._shift(ones, di, dj) for di, dj in self.offsets])
+
+    def edge_strategies(self):
+        # (2, edges * n * n): the strategy at each end of every edge
+        partners = np.stack([self._shift(self.grid, di, dj) for di, dj in self.offsets])
+        owners = np.broadcast_to(self.grid, partners.shape)
+        return np.stack([owners.reshape(-1), partners.reshape(-1)])
+
+    def calculate_scores(self):
+        payoffs = self.games.play(self.edge_strategies(), self.rounds, self.rng, names=self.strategies)
+        edges = len(self.offsets)
+        owner = payoffs[0].reshape(edges, self.n, self.n)
+        partner = payoffs[1].reshape(edges, self.n, self.n)
+        if self.boundary != 'periodic':
+            valid = self.edge_valid()
+            owner = owner * valid
+            partner = partner * valid
+        scores = owner.sum(axis=0)
+        for d, (di, dj) in enumerate(self.offsets):
+            scores += self._shift(partner[d], -di, -dj)
+        return scores
+
+    def step(self):
+        # Shifted to start at 1, so that no cell imitates the zero padding
+        # beyond a fixed boundary
+        scores = self.calculate_scores() + 1
+        new_grid = imitate_best(self.grid, scores, self.boundary, self.rng,
+                                neighborhood=self.neighborhood)
+        changed = new_grid != self.grid
+        if changed.any():
+            # Both ends of every edge touching a changed cell start over
+            stale = np.stack([changed | self._shift(changed, di, dj) for di, dj in self.offsets])
+            self.games.reset(stale.reshape(-1))
+        self.grid = new_grid
+        self.generation += 1
+        self.ts_data.append(self.shares())
+
+    def run(self, generations, callback=None):
+        for _ in range(generations):
+            self.step()
+            if callback is not None:
+                callback(self)
+
+
+def build_parser():
+    p = argparse.ArgumentParser(
+        description="Spatial iterated prisoner's dilemma with the titfortat.py strategies.")
+    p.add_argument('--n', type=int, default=100, help="grid size")
+    p.add_argument('--generations', type=int, default=100)
+    p.add_argument('--rounds', type=int, default=1, help="rounds per edge and generation")
+    p.add_argument('--neighborhood', default='Moore',
+                   help="Moore, vonNeumann or hexagonal, with an optional radius as in Moore:2")
+    p.add_argument('--boundary', default='periodic', choices=['periodic', 'fixed'])
+    p.add_argument('--seed', type=int, default=None)
+    p.add_argument('--format', default='csv', choices=['csv', 'jsonl'])
+    p.add_argument('-o', '--output', default='-', help="strategy shares per generation, '-' for stdout")
+    return p
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    lattice = StrategyLattice(args.n, args.neighborhood, args.boundary, args.rounds, seed=args.seed)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        writer = MetricsWriter(out, args.format, ('generation',) + STRATEGIES)
+
+        def record(lat):
+            row = {'generation': lat.generation}
+            row.update(zip(STRATEGIES, lat.shares().tolist()))
+            writer.write(row)
+
+        record(lattice)
+        lattice.run(args.generations, record)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from pd_engine import PDEngine
+
+JOB_FIELDS = ('b', 'boundary', 'neighborhood', 'seed')
+RESULT_FIELDS = JOB_FIELDS + ('n', 'generations', 'burn_in', 'final_coop_frac', 'mean_coop_frac',
+                              'avg_c_size', 'max_c_size', 'n_clusters', 'period', 'settled_at')
+
+
+def job_key(b, boundary, neighborhood, seed):
+    # b is rounded so that values read back from the CSV match the grid
+    return (round(float(b), 6), boundary, neighborhood, int(seed))
+
+
+def make_jobs(b_values, boundaries, neighborhoods, seeds):
+    return [job_key(b, boundary, neighborhood, seed)
+            for b in b_values
+            for boundary in boundaries
+            for neighborhood in neighborhoods
+            for seed in seeds]
+
+
+def run_job(job, n=100, generations=200, burn_in=50, max_period=8):
+    # Runs that settle into a fixed point or a cycle of up to max_period
+    # generations stop there and are extrapolated, with the same results as
+    # simulating every generation
+    b, boundary, neighborhood, seed = job
+    engine = PDEngine(n=n, b=b, neighborhood=neighborhood, boundary=boundary, seed=seed,
+                      cycle_window=max_period or None)
+    engine.run(generations)
+    if engine.period is not None:
+        engine.skip_to(generations)
+
+    stats = engine.get_cluster_stats()
+    return {
+        'b': b, 'boundary': boundary, 'neighborhood': neighborhood, 'seed': seed,
+        'n': n, 'generations': generations, 'burn_in': burn_in,
+        'final_coop_frac': float(engine.ts_data[-1]),
+        # Time average over the generations after the transient
+        'mean_coop_frac': float(np.mean(engine.ts_data[min(burn_in, generations):])),
+        'avg_c_size': float(stats['avg_c_size']),
+        'max_c_size': int(stats['max_c_size']),
+        'n_clusters': int(stats['n_clusters']),
+        # 0 and empty when the run never settled
+        'period': engine.period or 0,
+        'settled_at': engine.settled_at if engine.settled_at is not None else '',
+    }
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def same_settings(row, n, generations, burn_in):
+    # Whether a row was produced with these settings; max_period is not one
+    # of them, stopping at an attractor does not change the results. Files
+    # started by an older version have no burn_in column.
+    return (int(row['n']) == n and int(row['generations']) == generations
+            and int(row.get('burn_in') or burn_in) == burn_in)
+
+
+def completed_keys(rows):
+    return {job_key(r['b'], r['boundary'], r['neighborhood'], r['seed']) for r in rows}
+
+
+def run_sweep(jobs, output, n=100, generations=200, burn_in=50, workers=None, max_period=8):
+    # Results are appended to `output` as soon as each job finishes, so an
+    # interrupted sweep picks up where it stopped when run again. Rows of
+    # sweeps with other settings stay in the file but are neither reused
+    # nor returned.
+    def results():
+        return [row for row in load_results(output)
+                if same_settings(row, n, generations, burn_in)]
+
+    done = completed_keys(results())
+    todo = [job for job in jobs if job not in done]
+    if not todo:
+        return results()
+
+    new_file = not os.path.exists(output) or os.path.getsize(output) == 0
+    fields = RESULT_FIELDS
+    if not new_file:
+        # Keep the columns of a file started by an older version
+        with open(output, newline='') as f:
+            fields = next(csv.reader(f))
+    with open(output, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        if new_file:
+            writer.writeheader()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_job, job, n, generations, burn_in, max_period)
+                       for job in todo]
+            for future in as_completed(futures):
+                writer.writerow(future.result())
+                f.flush()
+    return results()
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description="Sweep the temptation b over many seeds in parallel.")
+    p.add_argument('--b-min', type=float, default=1.0)
+    p.add_argument('--b-max', type=float, default=2.5)
+    p.add_argument('--b-step', type=float, default=0.05)
+    p.add_argument('--boundaries', nargs='+', default=['periodic', 'fixed'],
+                   choices=['periodic', 'fixed'])
+    p.add_argument('--neighborhoods', nargs='+', default=['Moore', 'vonNeumann'],
+                   help="Moore, vonNeumann or hexagonal, with an optional radius as in Moore:2")
+    p.add_argument('--seeds', type=int, default=10, help="number of seeds per point")
+    p.add_argument('--n', type=int, default=100, help="grid size")
+    p.add_argument('--generations', type=int, default=200)
+    p.add_argument('--burn-in', type=int, default=50,
+                   help="generations skipped by the time-averaged cooperator fraction")
+    p.add_argument('--max-period', type=int, default=8,
+                   help="stop runs that reach a cycle of at most this many generations, 0 to "
+                        "always simulate every generation")
+    p.add_argument('--workers', type=int, default=None, help="defaults to all cores")
+    p.add_argument('-o', '--output', default='sweep.csv')
+    return p
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    b_values = np.arange(args.b_min, args.b_max + args.b_step / 2, args.b_step)
+    jobs = make_jobs(b_values, args.boundaries, args.neighborhoods, range(args.seeds))
+    rows = run_sweep(jobs, args.output, n=args.n, generations=args.generations,
+                     burn_in=args.burn_in, workers=args.workers, max_period=args.max_period)
+    print(f"{len(rows)} results in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import queue
+import threading
+import time
+
+
+class Frame:
+    # What the viewer needs to draw one generation, copied out of the engine
+    __slots__ = ('version', 'generation', 'grid', 'prev_grid', 'ts_data', 'ts_len',
+                 'cluster_stats', 'strategy_mode')
+
+    def __init__(self, version, engine, with_stats):
+        self.version = version
+        self.generation = engine.generation
+        self.grid = engine.grid.copy()
+        self.prev_grid = None if engine.prev_grid is None else engine.prev_grid.copy()
+        # The list is only ever appended to, so its first ts_len entries are stable
+        self.ts_data = engine.ts_data
+        self.ts_len = len(engine.ts_data)
+        self.cluster_stats = engine.latest_cluster_stats() if with_stats else None
+        self.strategy_mode = engine.strategy_mode
+
+    def time_series(self):
+        return self.ts_data[:self.ts_len]
+
+
+class EngineWorker:
+    # Steps a PDEngine on a background thread, as fast as possible or at
+    # target_rate generations per second.
+    #
+    # The viewer calls latest() from its own loop and gets the newest Frame.
+    # Frames are handed over by swapping a single reference, and the worker
+    # only copies a new one out of the engine once the previous one has been
+    # picked up, so intermediate generations are dropped for free.
+    #
+    # Anything that touches the engine from the GUI (slider, buttons) goes
+    # through submit() and runs on the worker between two generations.
+    def __init__(self, engine, target_rate=None, with_stats=True):
+        self.engine = engine
+        self.target_rate = target_rate
+        self.with_stats = with_stats
+        self.running = False
+        self._commands = queue.SimpleQueue()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._version = 0
+        self._wanted = True
+        self._frame = None
+        self._publish()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='pd-engine', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def set_running(self, running):
+        self.running = running
+        self._wake.set()
+
+    def toggle(self):
+        self.set_running(not self.running)
+
+    def submit(self, command):
+        # command(engine) runs on the worker thread between generations
+        self._commands.put(command)
+        self._wake.set()
+
+    def latest(self):
+        self._wanted = True
+        return self._frame
+
+    def _publish(self):
+        self._version += 1
+        self._wanted = False
+        self._frame = Frame(self._version, self.engine, self.with_stats)
+
+    def _apply_commands(self):
+        applied = False
+        while True:
+            try:
+                command = self._commands.get_nowait()
+            except queue.Empty:
+                return applied
+            command(self.engine)
+            applied = True
+
+    def _loop(self):
+        next_tick = time.perf_counter()
+        while not self._stopped:
+            applied = self._apply_commands()
+            if applied:
+                # Parameter changes are shown right away, even when paused
+                self._publish()
+
+            if not self.running:
+                self._wake.wait()
+                self._wake.clear()
+                next_tick = time.perf_counter()
+                continue
+
+            self.engine.step()
+            if self._wanted:
+                self._publish()
+
+            if self.target_rate:
+                next_tick += 1.0 / self.target_rate
+                delay = next_tick - time.perf_counter()
+                if delay > 0:
+                    self._wake.wait(delay)
+                    self._wake.clear()
+                else:
+                    next_tick = time.perf_counter()
+
+
+# Commands the GUIs submit. Every parameter change restarts the run.
+def reset(engine):
+    engine.reset()
+
+
+def toggle_boundary(engine):
+    engine.boundary = 'periodic' if engine.boundary == 'fixed' else 'fixed'
+    engine.reset()
+
+
+def set_params(**params):
+    def command(engine):
+        for name, value in params.items():
+            setattr(engine, name, value)
+        engine.reset()
+    return command
+
+
+def seek(generation):
+    # For a pd_record.ReplayEngine, jump to `generation` of the recording
+    def command(engine):
+        engine.seek(generation)
+    return command
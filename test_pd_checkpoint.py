@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from pd_checkpoint import load_checkpoint, save_checkpoint
+from pd_engine import PDEngine
+
+
+def settling_engine():
+    # Freezes at generation 6
+    return PDEngine(n=12, b=1.2, seed=4, tie_break='hashed', cycle_window=8)
+
+
+@pytest.mark.parametrize('saved_at', [1, 3, 5, 6])
+def test_resumed_run_settles_like_uninterrupted(tmp_path, saved_at):
+    reference = settling_engine()
+    reference.run(100)
+    assert (reference.period, reference.settled_at) == (1, 6)
+
+    engine = settling_engine()
+    engine.run(saved_at)
+    save_checkpoint(engine, tmp_path / 'run.npz')
+    resumed = load_checkpoint(tmp_path / 'run.npz')
+    assert resumed.period == (1 if saved_at == 6 else None)
+    resumed.run(100)
+    assert (resumed.period, resumed.settled_at) == (reference.period, reference.settled_at)
+    assert np.array_equal(resumed.grid, reference.grid)
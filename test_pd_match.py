@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+import titfortat
+
+MEMORY_ONE = [p for p in titfortat.players if titfortat.memory_one(p) is not None]
+DETERMINISTIC = [p for p in MEMORY_ONE if titfortat.is_deterministic(p)]
+
+
+@pytest.mark.parametrize('rounds', [1, 2, 7, 100])
+def test_expected_scores_match_played_matches(rounds):
+    expected = titfortat.expected_scores(DETERMINISTIC, rounds)
+    for i, p1 in enumerate(DETERMINISTIC):
+        for j, p2 in enumerate(DETERMINISTIC):
+            _, _, score1, _ = titfortat.play_match(p1, p2, rounds)
+            assert expected[i, j] == pytest.approx(score1), (p1, p2)
+
+
+@pytest.mark.parametrize('discount', [0.5, 0.9, 0.99])
+def test_infinite_discounted_game_is_limit_of_finite_ones(discount):
+    # discount ** 5000 is negligible for every discount here
+    infinite = titfortat.expected_scores(MEMORY_ONE, rounds=None, discount=discount)
+    finite = titfortat.expected_scores(MEMORY_ONE, rounds=5000, discount=discount)
+    assert np.allclose(infinite, finite, rtol=1e-9)
+
+
+@pytest.mark.parametrize('discount', [0.5, 0.9])
+def test_infinite_discounted_game_matches_played_matches(discount):
+    # The discounted sum of the payoffs of a long played match
+    infinite = titfortat.expected_scores(DETERMINISTIC, rounds=None, discount=discount)
+    for i, p1 in enumerate(DETERMINISTIC):
+        for j, p2 in enumerate(DETERMINISTIC):
+            history, _, _, _ = titfortat.play_match(p1, p2, 1000)
+            payoffs = [titfortat.payoff_matrix[moves][0] for moves in history]
+            played = sum(discount ** t * payoff for t, payoff in enumerate(payoffs))
+            assert infinite[i, j] == pytest.approx(played), (p1, p2)
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from pd_engine import PDEngine
+from pd_parallel import StripEngine
+
+
+# Any number of strips must reproduce the single-process run with hashed ties
+@pytest.mark.parametrize('workers', [1, 3, 7])
+@pytest.mark.parametrize('mode', ['imitate_best', 'tft'])
+@pytest.mark.parametrize('neighborhood', ['Moore', 'vonNeumann', 'Moore:2'])
+@pytest.mark.parametrize('boundary', ['periodic', 'fixed'])
+def test_strip_engine_matches_pd_engine(boundary, neighborhood, mode, workers):
+    n = 23
+    reference = PDEngine(n=n, neighborhood=neighborhood, boundary=boundary, seed=5,
+                         strategy_mode=mode, tie_break='hashed')
+    with StripEngine(n=n, neighborhood=neighborhood, boundary=boundary, seed=5,
+                     strategy_mode=mode, workers=workers) as engine:
+        for generation in range(1, 9):
+            reference.step()
+            engine.step()
+            assert np.array_equal(engine.grid, reference.grid), generation
+            assert np.array_equal(engine.prev_grid, reference.prev_grid), generation
+        assert engine.ts_data == reference.ts_data
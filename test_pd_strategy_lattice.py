@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+import titfortat
+from pd_strategy_lattice import PAYOFFS, STRATEGIES, EdgeGames
+
+DETERMINISTIC = [p for p in titfortat.players if titfortat.is_deterministic(p)]
+
+
+def test_strategies_follow_titfortat():
+    assert list(STRATEGIES) == [titfortat.player_name(p) for p in titfortat.players]
+    for (move1, move2), (payoff, _) in titfortat.payoff_matrix.items():
+        assert PAYOFFS[int(move1 == titfortat.COOPERATE), int(move2 == titfortat.COOPERATE)] == payoff
+
+
+# The vectorized rules must play every deterministic match like the
+# Python strategies
+@pytest.mark.parametrize('rounds', [1, 7, 100])
+def test_edge_games_match_play_match(rounds):
+    pairs = [(p1, p2) for p1 in DETERMINISTIC for p2 in DETERMINISTIC]
+    index = {name: s for s, name in enumerate(STRATEGIES)}
+    strategies = np.array([[index[titfortat.player_name(p)] for p, _ in pairs],
+                           [index[titfortat.player_name(p)] for _, p in pairs]])
+    scores = EdgeGames(len(pairs)).play(strategies, rounds)
+    for k, (p1, p2) in enumerate(pairs):
+        _, _, score1, score2 = titfortat.play_match(p1, p2, rounds)
+        assert (scores[0, k], scores[1, k]) == (score1, score2), (p1, p2)
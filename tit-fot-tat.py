@@ -1,10 +1,13 @@
-import numpy as np
 import tkinter as tk
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.colors import ListedColormap
-from scipy.ndimage import label
-from scipy.signal import convolve2d
+from pd_engine import PDEngine
+from pd_render import GridRenderer
+from pd_worker import EngineWorker, reset, set_params, toggle_boundary
+
+# The view polls the worker for a new frame this often
+FRAME_INTERVAL_MS = 30
 
 class EnhancedPDSimulator:
     def __init__(self, master):
@@ -12,42 +15,22 @@ class EnhancedPDSimulator:
         self.master.title("Enhanced Spatial PD Simulator")
         
         # Simulation parameters
-        self.n = 100
-        self.b = 1.8
-        self.running = False
-        self.neighborhood = 'Moore'
-        self.boundary = 'periodic'
-        self.initial_config = 'random'
-        self.strategy_mode = 'imitate_best'  # 'pure_c', 'pure_d', 'imitate_best', 'tft'
+        self.engine = PDEngine(n=100, b=1.8, neighborhood='Moore', boundary='periodic',
+                               initial_config='random',
+                               strategy_mode='imitate_best')  # 'pure_c', 'pure_d', 'imitate_best', 'tft'
+        # no cluster stats box in this viewer
+        self.worker = EngineWorker(self.engine, target_rate=20, with_stats=False)
+        self.drawn_version = None
         
         # Visualization parameters
         self.cmap = ListedColormap(['red', 'blue', 'yellow', 'green'])
-        self.ts_data = []
-        
-        # Initialize grid and previous grid
-        self.grid = self.initialize_grid()
-        self.prev_grid = None
         
         # Setup GUI
         self.setup_controls()
         self.setup_visualization()
-        self.reset_grid()  # ensure prev_grid is set correctly for TFT
-
-    def initialize_grid(self):
-        # initial random or single defector
-        if self.initial_config == 'random':
-            grid = np.random.choice([0, 1], size=(self.n, self.n))
-        else:  # 'single_d'
-            grid = np.ones((self.n, self.n), dtype=int)
-            grid[self.n//2, self.n//2] = 0
-
-        # override for pure strategies
-        if self.strategy_mode == 'pure_c':
-            return np.ones_like(grid)
-        elif self.strategy_mode == 'pure_d':
-            return np.zeros_like(grid)
-        else:  # imitate_best or tft
-            return grid
+        self.master.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.worker.start()
+        self.refresh()
 
     def setup_controls(self):
         cf = tk.Frame(self.master)
@@ -57,8 +40,15 @@ class EnhancedPDSimulator:
         self.b_slider = tk.Scale(cf, from_=1.0, to=2.5, resolution=0.1,
                                 label="Defector Advantage (b)", orient=tk.HORIZONTAL,
                                 command=lambda v: self.on_param_change())
-        self.b_slider.set(self.b)
+        self.b_slider.set(self.engine.b)
         self.b_slider.pack(side=tk.LEFT, padx=5)
+
+        # speed slider
+        self.speed_slider = tk.Scale(cf, from_=0, to=200, resolution=5,
+                                     label="Speed (gen/s, 0 = max)", orient=tk.HORIZONTAL,
+                                     command=lambda v: self.on_speed_change())
+        self.speed_slider.set(self.worker.target_rate)
+        self.speed_slider.pack(side=tk.LEFT, padx=5)
         
         # strategy buttons
         for text, mode in [
@@ -91,126 +81,48 @@ class EnhancedPDSimulator:
         self.ax_ts.legend()
         self.canvas = FigureCanvasTkAgg(self.fig, master=self.master)
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.renderer = GridRenderer(self.canvas, self.ax_grid, self.ax_ts, self.ts_line, self.cmap,
+                                     stats_text=False)
 
     def toggle_simulation(self):
-        self.running = not self.running
-        if self.running:
-            self.run_simulation()
+        self.worker.toggle()
     
-    def run_simulation(self):
-        if not self.running: return
-        self.update_grid()
-        self.update_plot()
-        self.master.after(50, self.run_simulation)
-
-    def update_grid(self):
-        new = np.zeros_like(self.grid)
-        scores = None
-        if self.strategy_mode == 'imitate_best':
-            self.prev_grid = self.grid.copy()
-            scores = self.calculate_scores()
-        elif self.strategy_mode == 'tft':
-            # For TFT, ensure prev_grid exists
-            old = self.prev_grid.copy() if self.prev_grid is not None else np.ones_like(self.grid)
-        else:
-            # pure strategies: no need prev_grid
-            self.prev_grid = None
-
-        for i in range(self.n):
-            for j in range(self.n):
-                mode = self.strategy_mode
-                if mode == 'pure_c':
-                    new[i,j] = 1
-                elif mode == 'pure_d':
-                    new[i,j] = 0
-                elif mode == 'tft':
-                    # inspect neighbors (3×3)
-                    neigh = [
-                        ((i+di)%self.n if self.boundary=='periodic' else i+di,
-                         (j+dj)%self.n if self.boundary=='periodic' else j+dj)
-                        for di in (-1,0,1) for dj in (-1,0,1)
-                        if 0 <= i+di < self.n and 0 <= j+dj < self.n
-                    ]
-                    defect_count = sum(1 for x,y in neigh if old[x,y] == 0)
-                    # defect only if majority defected
-                    new[i,j] = 0 if defect_count > len(neigh)/2 else 1
-                else:  # imitate_best
-                    neigh = [
-                        ((i+di)%self.n if self.boundary=='periodic' else i+di,
-                         (j+dj)%self.n if self.boundary=='periodic' else j+dj)
-                        for di in (-1,0,1) for dj in (-1,0,1)
-                        if 0 <= i+di < self.n and 0 <= j+dj < self.n
-                    ]
-                    local_scores = [scores[x,y] for x,y in neigh]
-                    max_s = max(local_scores)
-                    best = [neigh[k] for k,s in enumerate(local_scores) if s==max_s]
-                    x,y = best[np.random.randint(len(best))]
-                    new[i,j] = self.prev_grid[x,y]
-
-        self.grid = new
-
-    def calculate_scores(self):
-        kernel = np.ones((3,3)) if self.neighborhood=='Moore' else np.array([[0,1,0],[1,1,1],[0,1,0]])
-        bdry   = 'wrap' if self.boundary=='periodic' else 'fill'
-        cs = convolve2d(self.grid, kernel, mode='same', boundary=bdry)
-        ds = self.b * cs
-        return np.where(self.grid==1, cs, ds)
-
-    def update_plot(self):
+    def refresh(self):
+        # draw the newest generation the worker published, skipping the rest
+        frame = self.worker.latest()
+        if frame.version != self.drawn_version:
+            self.update_plot(frame)
+            self.drawn_version = frame.version
+        self.master.after(FRAME_INTERVAL_MS, self.refresh)
+
+    def update_plot(self, frame):
         # transitions only for imitate_best
-        if self.strategy_mode == 'imitate_best' and self.prev_grid is not None:
-            vis = np.where((self.grid==0)&(self.prev_grid==1),2,
-                   np.where((self.grid==1)&(self.prev_grid==0),3,self.grid))
-        else:
-            vis = self.grid
-        self.ax_grid.clear()
-        self.ax_grid.imshow(vis, cmap=self.cmap, vmin=0, vmax=3)
-        self.ax_grid.set_xticks([]); self.ax_grid.set_yticks([])
-
-        frac = np.mean(self.grid)
-        self.ts_data.append(frac)
-        self.ts_line.set_data(range(len(self.ts_data)), self.ts_data)
-        self.ax_ts.relim(); self.ax_ts.autoscale_view(scalex=True, scaley=False)
-        self.ax_ts.set_xlim(0, len(self.ts_data)+1)
-
-        self.canvas.draw()
-
-    def get_cluster_stats(self):
-        lab, n = label(self.grid, structure=np.ones((3,3)))
-        sizes = [np.sum(lab==i) for i in range(1,n+1)]
-        return {
-            'avg_c_size': np.mean(sizes) if sizes else 0,
-            'max_c_size': np.max(sizes) if sizes else 0,
-            'n_clusters': n
-        }
+        prev_grid = frame.prev_grid if frame.strategy_mode == 'imitate_best' else None
+        self.renderer.render(frame.grid, prev_grid, frame.time_series())
 
     def reset_grid(self):
-        # Initialize grids
-        self.grid = self.initialize_grid()
-        self.ts_data = []
-        # For TFT, seed prev_grid as all-cooperate
-        if self.strategy_mode == 'tft':
-            self.prev_grid = np.ones((self.n, self.n), dtype=int)
-        else:
-            self.prev_grid = None
-        self.update_plot()
+        self.worker.submit(reset)
 
     def toggle_boundary(self):
-        self.boundary = 'periodic' if self.boundary=='fixed' else 'fixed'
-        self.reset_grid()
+        self.worker.submit(toggle_boundary)
 
     def set_preset(self, v):
         self.b_slider.set(v)
         self.on_param_change()
 
     def set_strategy(self, mode):
-        self.strategy_mode = mode
-        self.running = False
-        self.reset_grid()
+        self.worker.set_running(False)
+        self.worker.submit(set_params(strategy_mode=mode))
 
     def on_param_change(self):
-        self.b = float(self.b_slider.get())
-        self.reset_grid()
+        self.worker.submit(set_params(b=float(self.b_slider.get())))
+
+    def on_speed_change(self):
+        self.worker.target_rate = float(self.speed_slider.get()) or None
+
+    def on_close(self):
+        self.worker.stop()
+        self.master.destroy()
 
 if __name__=="__main__":
     root = tk.Tk()
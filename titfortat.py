@@ -1,6 +1,14 @@
+import argparse
+import hashlib
+import os
 import random
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
 from colorama import Fore, Style
 import numpy as np
+
+from pd_cache import MatchCache
+from pd_match import expected_payoff_matrix, expected_payoffs, payoff_tables, play_memory_one
 # Define the actions
 COOPERATE = 'cooperate'
 DEFECT = 'defect'
@@ -25,104 +33,313 @@ def random_choice_neutral(history):
 def tit_for_tat(history):
     if not history:  # If it's the first round, cooperate
         return COOPERATE
-    opponent_last_move = history[-1][1]  # Get the opponent's last move
+    opponent_last_move = history.their_move(-1)  # Get the opponent's last move
     return opponent_last_move  # Mimic the opponent's last move
 
 def bully(history):
     if not history:  # If it's the first round, defect
         return DEFECT
-    opponent_last_move = history[-1][1]  # Get the opponent's last move
+    opponent_last_move = history.their_move(-1)  # Get the opponent's last move
     return COOPERATE if opponent_last_move == DEFECT else DEFECT  # Do the opposite of the opponent's last move
 
 def tat_for_tit(history):
     if not history:  # If it's the first round, cooperate
         return DEFECT
-    opponent_last_move = history[-1][1]  # Get the opponent's last move
+    opponent_last_move = history.their_move(-1)  # Get the opponent's last move
     return opponent_last_move  # Mimic the opponent's last move
 
 def tit_for_two_tats(history):
     if len(history) < 2:  # If it's the first or second round, cooperate
         return COOPERATE
-    opponent_last_two_moves = history[-2:]  # Get the opponent's last two moves
-    if all(move[1] == DEFECT for move in opponent_last_two_moves):  # If the opponent defected in the last two rounds
+    opponent_last_two_moves = history.their_last(2)  # Get the opponent's last two moves (1 = cooperate)
+    if not any(opponent_last_two_moves):  # If the opponent defected in the last two rounds
         return DEFECT
     return COOPERATE
-def original_gradual(history):
-    if not history:  # If it's the first round, cooperate
-        return COOPERATE
 
-    # Initialize state variables
-    if not hasattr(original_gradual, "calming"):
-        original_gradual.calming = False
-        original_gradual.punishing = False
-        original_gradual.punishment_count = 0
-        original_gradual.punishment_limit = 0
 
-    # Calming phase
-    if original_gradual.calming:
-        original_gradual.calming = False
+# Match histories. Both moves of every round are stored once, one byte per
+# move (1 = cooperate) in preallocated buffers, and each player sees them
+# through a MatchHistory from their own side. Strategies can read the moves as
+# arrays, the last k moves and running counts in O(1), while indexing,
+# slicing and iterating still give the old (own move, opponent move) string
+# tuples for strategies written against lists.
+MOVES = (DEFECT, COOPERATE)
+
+
+class MatchRecord:
+    __slots__ = ('moves', 'length', 'cooperations')
+
+    def __init__(self, rounds=100):
+        self.moves = (bytearray(rounds), bytearray(rounds))
+        self.length = 0
+        self.cooperations = [0, 0]
+
+    def append(self, move1, move2):
+        n = self.length
+        if n == len(self.moves[0]):
+            # Grow into new buffers, array views handed out earlier keep the old ones
+            self.moves = tuple(buffer + bytes(max(1, n)) for buffer in self.moves)
+        moves1, moves2 = self.moves
+        c1 = moves1[n] = move1 == COOPERATE
+        c2 = moves2[n] = move2 == COOPERATE
+        cooperations = self.cooperations
+        cooperations[0] += c1
+        cooperations[1] += c2
+        self.length = n + 1
+
+    def view(self, side):
+        return MatchHistory(self, side)
+
+
+class MatchHistory:
+    __slots__ = ('record', 'me', 'them')
+
+    def __init__(self, record, side):
+        self.record = record
+        self.me = side
+        self.them = 1 - side
+
+    def __len__(self):
+        return self.record.length
+
+    def _round(self, i):
+        moves = self.record.moves
+        return MOVES[moves[self.me][i]], MOVES[moves[self.them][i]]
+
+    def __getitem__(self, index):
+        n = self.record.length
+        if isinstance(index, slice):
+            return [self._round(i) for i in range(*index.indices(n))]
+        i = index + n if index < 0 else index
+        if not 0 <= i < n:
+            raise IndexError('history index out of range')
+        moves = self.record.moves
+        return MOVES[moves[self.me][i]], MOVES[moves[self.them][i]]
+
+    def __iter__(self):
+        return (self._round(i) for i in range(self.record.length))
+
+    # Single moves as strings, i counted from the end when negative. Cheaper
+    # than the tuple view, but i must lie within the history.
+    def my_move(self, i=-1):
+        r = self.record
+        return MOVES[r.moves[self.me][i + r.length if i < 0 else i]]
+
+    def their_move(self, i=-1):
+        r = self.record
+        return MOVES[r.moves[self.them][i + r.length if i < 0 else i]]
+
+    @property
+    def my_moves(self):
+        return np.frombuffer(self.record.moves[self.me], dtype=np.uint8, count=self.record.length)
+
+    @property
+    def their_moves(self):
+        return np.frombuffer(self.record.moves[self.them], dtype=np.uint8, count=self.record.length)
+
+    # The last k moves as a short bytes object, cheaper than an array view
+    def my_last(self, k):
+        n = self.record.length
+        return bytes(self.record.moves[self.me][max(0, n - k):n])
+
+    def their_last(self, k):
+        n = self.record.length
+        return bytes(self.record.moves[self.them][max(0, n - k):n])
+
+    @property
+    def my_cooperations(self):
+        return self.record.cooperations[self.me]
+
+    @property
+    def their_cooperations(self):
+        return self.record.cooperations[self.them]
+
+    @property
+    def my_defections(self):
+        return self.record.length - self.record.cooperations[self.me]
+
+    @property
+    def their_defections(self):
+        return self.record.length - self.record.cooperations[self.them]
+
+
+# Strategies that remember something beyond the history keep it in a
+# per-match state object. The tournament creates a fresh instance for every
+# match, so nothing leaks from one match into the next. Subclasses define
+# __call__(history) like the function-style strategies.
+class Strategy:
+    __slots__ = ()
+    name = None
+
+
+class FunctionStrategy(Strategy):
+    # Adapter for the stateless function-style strategies above
+    __slots__ = ('func',)
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, history):
+        return self.func(history)
+
+
+class OriginalGradual(Strategy):
+    __slots__ = ('calming', 'punishing', 'punishment_count', 'punishment_limit')
+    name = 'original_gradual'
+
+    def __init__(self):
+        self.calming = False
+        self.punishing = False
+        self.punishment_count = 0
+        self.punishment_limit = 0
+
+    def __call__(self, history):
+        if not history:  # If it's the first round, cooperate
+            return COOPERATE
+
+        # Calming phase
+        if self.calming:
+            self.calming = False
+            return COOPERATE
+
+        # Punishing phase
+        if self.punishing:
+            if self.punishment_count < self.punishment_limit:
+                self.punishment_count += 1
+                return DEFECT
+            else:
+                self.calming = True
+                self.punishing = False
+                self.punishment_count = 0
+                return COOPERATE
+
+        # Check if opponent defected in the last round
+        if history.their_move(-1) == DEFECT:
+            self.punishing = True
+            self.punishment_count += 1
+            self.punishment_limit += 1
+            return DEFECT
+
         return COOPERATE
 
-    # Punishing phase
-    if original_gradual.punishing:
-        if original_gradual.punishment_count < original_gradual.punishment_limit:
-            original_gradual.punishment_count += 1
+
+class ContriteTitForTat(Strategy):
+    __slots__ = ('contrite', 'last_recorded')
+    name = 'contrite_tit_for_tat'
+
+    def __init__(self):
+        self.contrite = False
+        self.last_recorded = None  # own move as recorded in the previous call
+
+    def __call__(self, history):
+        if not history:  # If it's the first round, cooperate
+            return COOPERATE
+
+        my_last_move = history.my_move(-1)
+        opponent_last_move = history.their_move(-1)
+
+        # If contrite but managed to cooperate: apologise.
+        if self.contrite and my_last_move == COOPERATE:
+            self.contrite = False
+            return COOPERATE
+
+        # Check if noise provoked opponent
+        if self.last_recorded is not None and self.last_recorded != my_last_move:  # Check if noise
+            if my_last_move == DEFECT and opponent_last_move == COOPERATE:
+                self.contrite = True
+
+        self.last_recorded = my_last_move
+        return opponent_last_move  # Mimic opponent's last move
+
+
+class SpitefulTitForTat(Strategy):
+    __slots__ = ('retaliating',)
+    name = 'spiteful_tit_for_tat'
+
+    def __init__(self):
+        self.retaliating = False
+
+    def __call__(self, history):
+        if not history:  # If it's the first round, cooperate
+            return COOPERATE
+
+        # Check if opponent defected twice in a row
+        if len(history) > 1 and history.their_move(-2) == DEFECT and history.their_move(-1) == DEFECT:
+            self.retaliating = True
+
+        # If retaliating, always defect
+        if self.retaliating:
             return DEFECT
         else:
-            original_gradual.calming = True
-            original_gradual.punishing = False
-            original_gradual.punishment_count = 0
-            return COOPERATE
+            # Mimic opponent's last move
+            return history.their_move(-1)
 
-    # Check if opponent defected in the last round
-    if history[-1][1] == DEFECT:
-        original_gradual.punishing = True
-        original_gradual.punishment_count += 1
-        original_gradual.punishment_limit += 1
-        return DEFECT
 
-    return COOPERATE
+def player_name(player):
+    # Players are either plain strategy functions or Strategy subclasses
+    return player.name if isinstance(player, type) else player.__name__
 
-def contrite_tit_for_tat(history):
-    if not history:  # If it's the first round, cooperate
-        return COOPERATE
 
-    # Initialize state variables
-    if not hasattr(contrite_tit_for_tat, "contrite"):
-        contrite_tit_for_tat.contrite = False
-        contrite_tit_for_tat._recorded_history = []
+def new_player(player):
+    # Fresh state for one match
+    return player() if isinstance(player, type) else FunctionStrategy(player)
 
-    # If contrite but managed to cooperate: apologise.
-    if contrite_tit_for_tat.contrite and history[-1][0] == COOPERATE:
-        contrite_tit_for_tat.contrite = False
-        return COOPERATE
 
-    # Check if noise provoked opponent
-    if contrite_tit_for_tat._recorded_history and contrite_tit_for_tat._recorded_history[-1] != history[-1][0]:  # Check if noise
-        if history[-1][0] == DEFECT and history[-1][1] == COOPERATE:
-            contrite_tit_for_tat.contrite = True
+# Strategies whose next move only depends on the previous round, as
+# (p_CC, p_CD, p_DC, p_DD, p_first) cooperation probabilities. Pairings of
+# these are played as array operations by pd_match, everything else goes
+# through play_match.
+MEMORY_ONE = {
+    'always_cooperate': (1, 1, 1, 1, 1),
+    'always_defect': (0, 0, 0, 0, 0),
+    'random_choice_cooperate': (0.75, 0.75, 0.75, 0.75, 0.75),
+    'random_choice_defect': (0.25, 0.25, 0.25, 0.25, 0.25),
+    'random_choice_neutral': (0.5, 0.5, 0.5, 0.5, 0.5),
+    'tit_for_tat': (1, 0, 1, 0, 1),
+    'tat_for_tit': (1, 0, 1, 0, 0),
+    'bully': (0, 1, 0, 1, 0),
+}
 
-    contrite_tit_for_tat._recorded_history.append(history[-1][0])
-    return history[-1][1]  # Mimic opponent's last move
-def spiteful_tit_for_tat(history):
-    if not history:  # If it's the first round, cooperate
-        return COOPERATE
 
-    # Initialize state variables
-    if not hasattr(spiteful_tit_for_tat, "retaliating"):
-        spiteful_tit_for_tat.retaliating = False
+def memory_one(player):
+    return MEMORY_ONE.get(player_name(player))
 
-    # Check if opponent defected twice in a row
-    if len(history) > 1 and history[-2][1] == DEFECT and history[-1][1] == DEFECT:
-        spiteful_tit_for_tat.retaliating = True
 
-    # If retaliating, always defect
-    if spiteful_tit_for_tat.retaliating:
-        return DEFECT
+# Strategies with longer memory that never draw random numbers. Together with
+# the memory-one strategies whose vector is all 0s and 1s, their matches
+# always play out the same way and are only simulated once.
+DETERMINISTIC = {'tit_for_two_tats', 'original_gradual', 'contrite_tit_for_tat', 'spiteful_tit_for_tat'}
+
+
+def is_deterministic(player):
+    vector = memory_one(player)
+    if vector is not None:
+        return all(p in (0, 1) for p in vector)
+    return player_name(player) in DETERMINISTIC
+
+
+def strategy_identity(player):
+    # Name plus a hash of the code, so an edited strategy misses the cache
+    if isinstance(player, type):
+        codes = [f.__code__ for f in vars(player).values() if hasattr(f, '__code__')]
     else:
-        # Mimic opponent's last move
-        return history[-1][1]
-players = [always_cooperate, always_defect, random_choice_defect, tit_for_tat, tit_for_two_tats, random_choice_cooperate, tat_for_tit, random_choice_neutral, bully,original_gradual, contrite_tit_for_tat, spiteful_tit_for_tat]
+        codes = [player.__code__]
+    digest = hashlib.sha1()
+    while codes:
+        code = codes.pop()
+        digest.update(code.co_code)
+        # The bytecode refers to globals, attributes and locals by index only
+        digest.update(repr((code.co_names, code.co_varnames)).encode())
+        for const in code.co_consts:
+            # Nested code objects (e.g. generator expressions) repr with their address
+            if hasattr(const, 'co_code'):
+                codes.append(const)
+            else:
+                digest.update(repr(const).encode())
+    return f'{player_name(player)}:{digest.hexdigest()[:12]}'
+
+
+players = [always_cooperate, always_defect, random_choice_defect, tit_for_tat, tit_for_two_tats, random_choice_cooperate, tat_for_tit, random_choice_neutral, bully, OriginalGradual, ContriteTitForTat, SpitefulTitForTat]
 
 # Define the payoff matrix
 payoff_matrix = {
@@ -151,51 +368,64 @@ player_colors = {
     'spiteful_tit_for_tat': '\033[38;2;80;255;255m'  # Light cyan
 }
 
-def tournament(players, rounds=100, filter_strategy='tat_for_tit'):
-    total_scores = {player.__name__: 0 for player in players}
-    wins = {player.__name__: 0 for player in players}
-    losses = {player.__name__: 0 for player in players}  # New dictionary to store losses
-    draws = {player.__name__: 0 for player in players}  # New dictionary to store draws
+def play_match(player1, player2, rounds=100):
+    # Each side gets its own fresh strategy state for this match
+    strategy1 = new_player(player1)
+    strategy2 = new_player(player2)
+    record = MatchRecord(rounds)
+    history1 = record.view(0)
+    history2 = record.view(1)
+    score1 = score2 = 0
+    for round in range(rounds):
+        move1 = strategy1(history1)
+        move2 = strategy2(history2)
+        payoff1, payoff2 = payoff_matrix[(move1, move2)]
+        score1 += payoff1
+        score2 += payoff2
+        record.append(move1, move2)
+    return history1, history2, score1, score2
+
+
+def tournament(players, rounds=100, filter_strategy='tat_for_tit', verbose=True):
+    names = [player_name(player) for player in players]
+    total_scores = {name: 0 for name in names}
+    wins = {name: 0 for name in names}
+    losses = {name: 0 for name in names}  # New dictionary to store losses
+    draws = {name: 0 for name in names}  # New dictionary to store draws
     for i in range(len(players)):
         for j in range(i, len(players)):
-            player1 = players[i]
-            player2 = players[j]
-            history1 = []
-            history2 = []
-            match_scores = {player1.__name__: 0, player2.__name__: 0}
-            for round in range(rounds):
-                move1 = player1(history1)
-                move2 = player2(history2)
-                score1, score2 = payoff_matrix[(move1, move2)]
-                match_scores[player1.__name__] += score1
-                match_scores[player2.__name__] += score2
-                total_scores[player1.__name__] += score1
-                total_scores[player2.__name__] += score2
-                history1.append((move1, move2))
-                history2.append((move2, move1))
+            name1 = names[i]
+            name2 = names[j]
+            history1, history2, score1, score2 = play_match(players[i], players[j], rounds)
+            match_scores = {name1: 0, name2: 0}
+            match_scores[name1] += score1
+            match_scores[name2] += score2
+            total_scores[name1] += score1
+            total_scores[name2] += score2
 
             # Increment win, loss, or draw count based on the match result
-            if match_scores[player1.__name__] > match_scores[player2.__name__]:
-                wins[player1.__name__] += 1
-                losses[player2.__name__] += 1
-            elif match_scores[player1.__name__] < match_scores[player2.__name__]:
-                wins[player2.__name__] += 1
-                losses[player1.__name__] += 1
+            if match_scores[name1] > match_scores[name2]:
+                wins[name1] += 1
+                losses[name2] += 1
+            elif match_scores[name1] < match_scores[name2]:
+                wins[name2] += 1
+                losses[name1] += 1
             else:
-                draws[player1.__name__] += 1
-                draws[player2.__name__] += 1
+                draws[name1] += 1
+                draws[name2] += 1
 
 
-            if  (player2.__name__ == filter_strategy) :
-                print(f"\n{player_colors.get(player1.__name__, Fore.RESET)}{player1.__name__[:15].ljust(15)} moves: {''.join([Fore.GREEN+'O'+Style.RESET_ALL if move[0]==COOPERATE else Fore.RED+'X'+Style.RESET_ALL for move in history1])}")
-                print(f"{player_colors.get(player2.__name__, Fore.RESET)}{player2.__name__[:15].ljust(15)} moves: {''.join([Fore.GREEN+'O'+Style.RESET_ALL if move[0]==COOPERATE else Fore.RED+'X'+Style.RESET_ALL for move in history2])}")
-                print(f"Match scores: {player1.__name__} {match_scores[player1.__name__]}, {player2.__name__} {match_scores[player2.__name__]}")  
+            if verbose and name2 == filter_strategy:
+                print(f"\n{player_colors.get(name1, Fore.RESET)}{name1[:15].ljust(15)} moves: {''.join([Fore.GREEN+'O'+Style.RESET_ALL if move[0]==COOPERATE else Fore.RED+'X'+Style.RESET_ALL for move in history1])}")
+                print(f"{player_colors.get(name2, Fore.RESET)}{name2[:15].ljust(15)} moves: {''.join([Fore.GREEN+'O'+Style.RESET_ALL if move[0]==COOPERATE else Fore.RED+'X'+Style.RESET_ALL for move in history2])}")
+                print(f"Match scores: {name1} {match_scores[name1]}, {name2} {match_scores[name2]}")  
                 
-            # print(f"\n{player_colors.get(player1.__name__, Fore.RESET)}{player1.__name__[:15].ljust(15)} moves: {''.join([Fore.GREEN+'O'+Style.RESET_ALL if move[0]==COOPERATE else Fore.RED+'X'+Style.RESET_ALL for move in history1])}")
-            # print(f"{player_colors.get(player2.__name__, Fore.RESET)}{player2.__name__[:15].ljust(15)} moves: {''.join([Fore.GREEN+'O'+Style.RESET_ALL if move[0]==COOPERATE else Fore.RED+'X'+Style.RESET_ALL for move in history2])}")
-            # print(f"Match scores: {player1.__name__} {match_scores[player1.__name__]}, {player2.__name__} {match_scores[player2.__name__]}")  
-    for player in players:
-        print(f'{player.__name__}: {wins[player.__name__]} wins, {losses[player.__name__]} losses, {draws[player.__name__]} draws')
+            # print(f"\n{player_colors.get(name1, Fore.RESET)}{name1[:15].ljust(15)} moves: {''.join([Fore.GREEN+'O'+Style.RESET_ALL if move[0]==COOPERATE else Fore.RED+'X'+Style.RESET_ALL for move in history1])}")
+            # print(f"{player_colors.get(name2, Fore.RESET)}{name2[:15].ljust(15)} moves: {''.join([Fore.GREEN+'O'+Style.RESET_ALL if move[0]==COOPERATE else Fore.RED+'X'+Style.RESET_ALL for move in history2])}")
+            # print(f"Match scores: {name1} {match_scores[name1]}, {name2} {match_scores[name2]}")  
+    if verbose:
+        for name in names:
+            print(f'{name}: {wins[name]} wins, {losses[name]} losses, {draws[name]} draws')
 
     sorted_scores = sorted(total_scores.items(), key=lambda item: item[1], reverse=True)
     return sorted_scores
@@ -204,33 +434,239 @@ def tournament(players, rounds=100, filter_strategy='tat_for_tit'):
 # for player, score in tournament(players):
 #     print(f'\nFinal score: {player}: {score}')
 
-num_tournaments = 1
-results = {player.__name__: [] for player in players}
+def match_key(player1, player2, rounds):
+    payoffs = sorted((list(moves), list(payoff)) for moves, payoff in payoff_matrix.items())
+    return (strategy_identity(player1), strategy_identity(player2), rounds, payoffs)
+
+
+def cached_match(player1, player2, rounds=100, cache=None):
+    # Scores of a deterministic match, simulated only when `cache` lacks it
+    if cache is not None:
+        entry = cache.get(match_key(player1, player2, rounds))
+        if entry is not None:
+            return tuple(entry['scores'])
+    history1, _, score1, score2 = play_match(player1, player2, rounds)
+    if cache is not None:
+        cache.put(match_key(player1, player2, rounds), score1, score2,
+                  history1.my_moves, history1.their_moves)
+    return score1, score2
+
+
+def deterministic_scores(players, rounds=100, cache=None):
+    # {(i, j): (score1, score2)} for every pairing of two deterministic players
+    return {(i, j): cached_match(players[i], players[j], rounds, cache)
+            for i in range(len(players)) for j in range(i, len(players))
+            if is_deterministic(players[i]) and is_deterministic(players[j])}
+
+
+def round_robin_scores(players, rounds=100, repetitions=1, rng=None, exact=True, known=None):
+    # Total score of every player in `repetitions` quiet round robins, as
+    # {name: array of length repetitions}. Pairings of deterministic players
+    # are looked up in `known` (from deterministic_scores) and added to every
+    # repetition. With `exact`, memory-one pairings add their exact expected
+    # score too; otherwise they are all sampled at once. The other pairings
+    # fall back to play_match. The random_* strategies draw from `rng` in the
+    # first case and from the random module otherwise.
+    if known is None:
+        known = deterministic_scores(players, rounds)
+    names = [player_name(player) for player in players]
+    totals = {name: np.zeros(repetitions) for name in names}
+    pairs = [(i, j) for i in range(len(players)) for j in range(i, len(players))
+             if (i, j) not in known]
+    vectors = [memory_one(player) for player in players]
+    fast = [(i, j) for i, j in pairs if vectors[i] is not None and vectors[j] is not None]
+    slow = [(i, j) for i, j in pairs if vectors[i] is None or vectors[j] is None]
+
+    for (i, j), (score1, score2) in known.items():
+        totals[names[i]] += score1
+        totals[names[j]] += score2
+
+    if fast:
+        pay1, pay2 = payoff_tables(payoff_matrix, COOPERATE, DEFECT)
+        p1 = [vectors[i] for i, _ in fast]
+        p2 = [vectors[j] for _, j in fast]
+        if exact:
+            score1, score2 = expected_payoffs(p1, p2, pay1, pay2, rounds)
+            score1, score2 = score1[:, None], score2[:, None]
+        else:
+            score1, score2 = play_memory_one(p1, p2, pay1, pay2, rounds, repetitions, rng)
+        for q, (i, j) in enumerate(fast):
+            totals[names[i]] += score1[q]
+            totals[names[j]] += score2[q]
+    for i, j in slow:
+        for r in range(repetitions):
+            _, _, score1, score2 = play_match(players[i], players[j], rounds)
+            totals[names[i]][r] += score1
+            totals[names[j]][r] += score2
+    return totals
+
+
+def expected_scores(players, rounds=100, discount=1.0):
+    # Exact expected payoff matrix of memory-one players, A[i, j] is what
+    # players[i] expects to score against players[j]. rounds=None with
+    # discount < 1 gives the infinitely repeated discounted game.
+    vectors = [memory_one(player) for player in players]
+    others = [player_name(p) for p, vector in zip(players, vectors) if vector is None]
+    if others:
+        raise ValueError(f"not memory-one strategies: {', '.join(others)}")
+    pay1, pay2 = payoff_tables(payoff_matrix, COOPERATE, DEFECT)
+    return expected_payoff_matrix(vectors, pay1, pay2, rounds, discount)
+
+
+def pairwise_payoffs(players, rounds=100, samples=200, cache=None, seed=None):
+    # A[i, j] is the mean score of players[i] in a match against players[j]:
+    # exact for deterministic and memory-one pairings, averaged over
+    # `samples` matches for the rest. A player against itself gets the mean
+    # of both sides.
+    if seed is not None:
+        random.seed(seed)
+    k = len(players)
+    scores = {}
+    known = deterministic_scores(players, rounds, cache)
+    vectors = [memory_one(player) for player in players]
+    fast = []
+    for i in range(k):
+        for j in range(i, k):
+            if (i, j) in known:
+                scores[(i, j)] = known[(i, j)]
+            elif vectors[i] is not None and vectors[j] is not None:
+                fast.append((i, j))
+            else:
+                samples_ij = [play_match(players[i], players[j], rounds)[2:] for _ in range(samples)]
+                scores[(i, j)] = tuple(np.mean(samples_ij, axis=0))
+    if fast:
+        pay1, pay2 = payoff_tables(payoff_matrix, COOPERATE, DEFECT)
+        score1, score2 = expected_payoffs([vectors[i] for i, _ in fast], [vectors[j] for _, j in fast],
+                                          pay1, pay2, rounds)
+        scores.update(zip(fast, zip(score1, score2)))
+
+    payoffs = np.zeros((k, k))
+    for (i, j), (score1, score2) in scores.items():
+        if i == j:
+            payoffs[i, i] = (score1 + score2) / 2
+        else:
+            payoffs[i, j], payoffs[j, i] = score1, score2
+    return payoffs
+
 
-for _ in range(num_tournaments):
-    for player, score in tournament(players):
-        results[player].append(score)
+# Monte Carlo runs: many independent tournaments, spread over a process pool.
+# Tournaments are played in batches of TOURNAMENT_BATCH, each batch seeding
+# the `random` module from its own child of one master seed, so the results
+# only depend on the seed and the batch size, not on the number of workers
+# or on which worker ran which batch.
+TOURNAMENT_BATCH = 200
 
-# Calculate the median score for each player and store them in a list of tuples
-medians = [(player, np.mean(scores)) for player, scores in results.items()]
 
-# Sort the list of tuples based on the median score
-sorted_medians = sorted(medians, key=lambda x: x[1])
+def batch_seeds(num_batches, seed=None):
+    children = np.random.SeedSequence(seed).spawn(num_batches)
+    return [int(child.generate_state(1)[0]) for child in children]
 
-num_players = len(sorted_medians)
 
-# Print the sorted median scores with gradient color
-for i, (player, median_score) in enumerate(sorted_medians):
-    # Calculate the ratio of green and red based on the player's position
-    green_ratio = i / (num_players - 1)
-    red_ratio = 1 - green_ratio
+def _run_batch(players, seed, size, rounds, exact, known):
+    # Runs in a worker process
+    random.seed(seed)
+    return round_robin_scores(players, rounds, size, np.random.default_rng(seed), exact, known)
 
-    # Calculate the green and red components of the color
-    green = int(green_ratio * 255)
-    red = int(red_ratio * 255)
 
-    # Create the color code
-    color_code = f'\033[38;2;{red};{green};0m'
-    player_color = player_colors.get(player, Fore.RESET)
-    # Print the player name and median score with the color
-    print(f'{player_color}{player}: {median_score} coins')
\ No newline at end of file
+def run_tournaments(players, num_tournaments, rounds=100, seed=None, workers=None,
+                    batch_size=TOURNAMENT_BATCH, exact=True, cache=None):
+    # Returns {player name: [total score in each tournament]}. Deterministic
+    # pairings are resolved once, through `cache` if given, before any batch
+    # is dispatched.
+    known = deterministic_scores(players, rounds, cache)
+    sizes = [min(batch_size, num_tournaments - k) for k in range(0, num_tournaments, batch_size)]
+    seeds = batch_seeds(len(sizes), seed)
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        batch_scores = [_run_batch(players, s, size, rounds, exact, known)
+                        for s, size in zip(seeds, sizes)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            batch_scores = list(pool.map(_run_batch, [players] * len(sizes), seeds, sizes,
+                                         [rounds] * len(sizes), [exact] * len(sizes),
+                                         [known] * len(sizes)))
+
+    results = {player_name(player): [] for player in players}
+    for totals in batch_scores:
+        for name, scores in totals.items():
+            results[name].extend(scores.tolist())
+    return results
+
+
+def confidence_interval(scores, level=0.95):
+    # Normal approximation for the mean score, fine for the thousands of
+    # tournaments the stochastic strategies need
+    scores = np.asarray(scores, dtype=float)
+    mean = scores.mean()
+    if len(scores) < 2:
+        return mean, mean
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+    half = z * scores.std(ddof=1) / np.sqrt(len(scores))
+    return mean - half, mean + half
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description="Round robin tournament of the iterated prisoner's dilemma strategies.")
+    p.add_argument('--tournaments', type=int, default=1,
+                   help="independent tournaments, more than one runs them on a process pool")
+    p.add_argument('--rounds', type=int, default=100)
+    p.add_argument('--seed', type=int, default=None, help="master seed for reproducible runs")
+    p.add_argument('--workers', type=int, default=None, help="defaults to all cores")
+    p.add_argument('--confidence', type=float, default=0.95)
+    p.add_argument('--sample-memory-one', action='store_true',
+                   help="sample memory-one pairings instead of using their exact expected scores")
+    p.add_argument('--cache', default=None,
+                   help="JSON file keeping the scores of deterministic matches between runs")
+    p.add_argument('--cache-size', type=int, default=10000, help="most matches kept in the cache")
+    p.add_argument('--cache-histories', action='store_true',
+                   help="also keep the packed move histories in the cache")
+    return p
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.tournaments == 1:
+        # A single tournament also prints the match details
+        if args.seed is not None:
+            random.seed(args.seed)
+        results = {player: [score] for player, score in tournament(players, args.rounds)}
+    else:
+        cache = None
+        if args.cache:
+            cache = MatchCache(args.cache, args.cache_size, args.cache_histories)
+        results = run_tournaments(players, args.tournaments, rounds=args.rounds, seed=args.seed,
+                                  workers=args.workers, exact=not args.sample_memory_one,
+                                  cache=cache)
+        if cache is not None:
+            cache.save()
+
+    # Calculate the median score for each player and store them in a list of tuples
+    medians = [(player, np.mean(scores)) for player, scores in results.items()]
+
+    # Sort the list of tuples based on the median score
+    sorted_medians = sorted(medians, key=lambda x: x[1])
+
+    num_players = len(sorted_medians)
+
+    # Print the sorted median scores with gradient color
+    for i, (player, median_score) in enumerate(sorted_medians):
+        # Calculate the ratio of green and red based on the player's position
+        green_ratio = i / (num_players - 1)
+        red_ratio = 1 - green_ratio
+
+        # Calculate the green and red components of the color
+        green = int(green_ratio * 255)
+        red = int(red_ratio * 255)
+
+        # Create the color code
+        color_code = f'\033[38;2;{red};{green};0m'
+        player_color = player_colors.get(player, Fore.RESET)
+        # Print the player name and median score with the color
+        low, high = confidence_interval(results[player], args.confidence)
+        print(f'{player_color}{player}: {median_score} coins'
+              + (f' ({args.confidence:.0%} CI {low:.1f} to {high:.1f})' if args.tournaments > 1 else ''))
+
+
+if __name__ == "__main__":
+    main()